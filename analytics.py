@@ -0,0 +1,113 @@
+# vectorized statistics over many timeseries at once
+# all functions take a (series x time) float matrix with NaN for missing values, as returned
+# by to_matrix, and return one value per series (or per series and window)
+
+import numpy as np
+
+
+def to_matrix(timeseries):
+    # timeseries: dict {ticker_symbol: timeseries} like MultiThreader.call_timeseries returns it
+    # or a list of timeseries. A timeseries is a call_timeseries dict or a plain list of values.
+    # series are right aligned (the last values share the last column) and padded with NaN,
+    # None values inside of a series become NaN as well.
+    # returns (ticker_symbols, values), ticker_symbols is None if a list was passed
+    if isinstance(timeseries, dict):
+        ticker_symbols = list(timeseries)
+        series = list(timeseries.values())
+    else:
+        ticker_symbols = None
+        series = list(timeseries)
+    series = [s["values"] if isinstance(s, dict) else s for s in series]
+
+    length = max((len(s) for s in series), default=0)
+    values = np.full((len(series), length), np.nan)
+    for i, s in enumerate(series):
+        if len(s):
+            values[i, length - len(s):] = np.array(s, dtype=float)
+    return ticker_symbols, values
+
+
+def positions(values):
+    # x values of the regression: 0 at the first valid value of every series
+    valid = ~np.isnan(values)
+    first = np.where(valid.any(axis=1), valid.argmax(axis=1), 0)
+    return np.arange(values.shape[1])[None, :] - first[:, None]
+
+
+def regression_sums(x, y, valid):
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    return valid.sum(axis=-1), x.sum(axis=-1), y.sum(axis=-1), (x*x).sum(axis=-1), (x*y).sum(axis=-1), (y*y).sum(axis=-1)
+
+
+def solve(n, sx, sy, sxx, sxy, syy):
+    # closed form ordinary least squares on precomputed sums, NaN where less than two points
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var_x = n*sxx - sx*sx
+        var_y = n*syy - sy*sy
+        cov = n*sxy - sx*sy
+        slope = cov / var_x
+        intercept = (sy - slope*sx) / n
+        r2 = np.where(var_y > 0, cov*cov / (var_x*var_y), 1.0)
+    degenerate = (n < 2) | (var_x <= 0)
+    slope[degenerate] = np.nan
+    intercept[degenerate] = np.nan
+    r2 = np.where(degenerate, np.nan, r2)
+    return slope, intercept, r2
+
+
+def trend(values):
+    # linear trend of every series against its own index (0 at the first valid value)
+    # returns (slope, intercept, r2), one value per series
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    return solve(*regression_sums(positions(values).astype(float), values, valid))
+
+
+def rolling_trend(values, window):
+    # trend over every window of window consecutive columns, x starts at 0 in every window
+    # returns (slope, intercept, r2) each with shape (series x n_columns - window + 1),
+    # windows containing a missing value are NaN
+    values = np.asarray(values, dtype=float)
+    if window < 2 or window > values.shape[1]:
+        raise ValueError(f"Invalid window <{window}> for series of length <{values.shape[1]}>")
+    windows = np.lib.stride_tricks.sliding_window_view(values, window, axis=1)
+    complete = ~np.isnan(windows).any(axis=-1)
+    x = np.arange(window, dtype=float)
+    n = np.full(complete.shape, float(window))
+    sx = np.full(complete.shape, x.sum())
+    sxx = np.full(complete.shape, (x*x).sum())
+    filled = np.where(np.isnan(windows), 0.0, windows)
+    sy = filled.sum(axis=-1)
+    sxy = filled @ x
+    syy = (filled*filled).sum(axis=-1)
+    slope, intercept, r2 = solve(n, sx, sy, sxx, sxy, syy)
+    for result in (slope, intercept, r2):
+        result[~complete] = np.nan
+    return slope, intercept, r2
+
+
+def log_returns(values):
+    # log returns between consecutive columns, one column less than values
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.diff(np.log(values), axis=1)
+    returns[~np.isfinite(returns)] = np.nan
+    return returns
+
+
+def log_return_stats(values, periods_per_year=252):
+    # returns a dict of per series vectors: mean, std, annualized mean / volatility,
+    # cumulative log return and the number of returns used
+    returns = log_returns(values)
+    valid = ~np.isnan(returns)
+    count = valid.sum(axis=1)
+    filled = np.where(valid, returns, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = filled.sum(axis=1) / count
+        std = np.sqrt(np.where(valid, (returns - mean[:, None])**2, 0.0).sum(axis=1) / (count - 1))
+    mean[count < 1] = np.nan
+    std[count < 2] = np.nan
+    cumulative = np.where(count > 0, filled.sum(axis=1), np.nan)
+    return {"mean": mean, "std": std, "annualizedMean": mean*periods_per_year,
+            "annualizedVolatility": std*np.sqrt(periods_per_year), "cumulative": cumulative, "count": count}
@@ -2,7 +2,11 @@
 # Documentation is at: https://financialmodelingprep.com/developer/docs/
 # Date format is always: "YYYY-MM-DD" e.g. "2021-11-08"
 
+import os
+import re
 import hashlib
+import bisect
+import threading
 from bs4 import BeautifulSoup
 import urllib
 import time
@@ -11,18 +15,23 @@ import requests
 import datetime
 import warnings
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 import json
 import numpy as np
-from auxiliary_functions import is_number
+from auxiliary_functions import is_number, RateLimiter, DeadlineExceeded, request_timeout, run_batch
+from decoding import get_decoder, fields_reducer
+from cache import CacheError, MemoryCache
 
 
 class InvalidResponse(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+class EmptyResponse(InvalidResponse):
+    # the api answered with an empty list, e.g. no data inside of the requested window
+    pass
         
 class InvalidRequest(Exception):
     def __init__(self, message):
@@ -30,19 +39,110 @@ class InvalidRequest(Exception):
         super().__init__(self.message)
 
 class FinancialModelingPrep:
-    def __init__(self, api_key):
+    # seconds responses of these endpoints are kept in the cache, other endpoints are not cached
+    cache_ttls = {"/v3/profile/": 60*60*24, "/v3/balance-sheet-statement/": 60*60*24,
+                  "/v3/income-statement/": 60*60*24, "/v3/ratios-ttm/": 60*60*24,
+                  "/v3/analyst-estimates/": 60*60*24, "/v4/shares_float": 60*60*24,
+                  "/v3/financial-statement-symbol-lists": 60*60*24,
+                  "/v3/historical-price-full/": 60*60, "/v3/historical-chart/1min/": 60}
+
+    def __init__(self, api_key, decoder=None, cache=None, cache_ttls=None):
+        # api_key can be a single key or a KeyPool to spread requests over several keys
+        # decoder: see decoding.py, defaults to the fastest installed json backend
+        # cache: a CacheBackend from cache.py shared with other workers, e.g. RedisCache
+        # cache_ttls: overrides the class attribute cache_ttls
+        # pools are detected by their interface, key_pool.KeyPool and api.key_pool.KeyPool are
+        # different classes depending on the import path
+        self.key_pool = None
+        if hasattr(api_key, "acquire"):
+            self.key_pool = api_key
+            api_key = api_key.placeholder
         self.api_key = api_key
         self.base_path = "https://financialmodelingprep.com/api"
+        self.decoder = decoder if decoder is not None else get_decoder()
+        self.cache = cache
+        if cache_ttls is not None:
+            self.cache_ttls = cache_ttls
+        self.local_cache = MemoryCache()  # filled by prefetch
+        self.symbol_index = None
+        self.earnings_calendar = None
+        self.treasury_curve = None
     
-    def make_request(self, url):
-        response = requests.request("GET", url).json()
+    def make_request(self, url, reducer=None):
+        # reducer: optional function applied to the decoded payload, e.g. fields_reducer("date", "close")
+        response = self.decoder.decode(self.get_content(url), reducer)
         if response == []:
-            raise InvalidResponse(f"Invalid Response from API for url <{url}>")
+            raise EmptyResponse(f"Invalid Response from API for url <{url}>")
         elif "Error Message" in response:
             raise InvalidResponse(f'{response["Error Message"]}. url: {url}')
         
         return response
     
+    def cache_key(self, url):
+        # the url without the api key, shared by all keys and workers
+        return re.sub(r"apikey=[^&]*&?", "", url.replace(self.base_path, "fmp")).rstrip("?&")
+
+    def cache_ttl(self, url):
+        for path, ttl in self.cache_ttls.items():
+            if path in url:
+                return ttl
+        return None
+
+    def get_content(self, url):
+        # returns the raw response body of url, from the cache if the endpoint is cached
+        ttl = self.cache_ttl(url) if self.cache is not None else None
+        if ttl is None:
+            return self.fetch_content(url).content
+
+        key = self.cache_key(url)
+        content = self.local_cache.get(key)
+        if content is not None:
+            return content
+        try:
+            content = self.cache.get(key)
+        except (CacheError, OSError) as e:
+            warnings.warn(f"Cache unavailable, requesting <{key}> directly: {e}")
+        if content is not None:
+            return content
+
+        http_response = self.fetch_content(url)
+        content = http_response.content
+        # only successful answers are cached, not rate limit or server errors, empty answers and error messages
+        if (http_response.status_code == 200 and content.strip() not in (b"", b"[]", b"{}")
+                and b'"Error Message"' not in content[:100]):
+            try:
+                self.cache.set(key, content, ttl)
+            except (CacheError, OSError) as e:
+                warnings.warn(f"Cache unavailable, could not store <{key}>: {e}")
+        return content
+
+    def prefetch(self, urls):
+        # loads all cached urls with one batched multi get into the local cache and returns
+        # the urls that are not cached, use it before iterating over ticker lists
+        if self.cache is None:
+            return list(urls)
+        keys = {self.cache_key(url): url for url in urls if self.cache_ttl(url) is not None}
+        try:
+            hits = self.cache.get_many(list(keys))
+        except (CacheError, OSError) as e:
+            warnings.warn(f"Cache unavailable, skipping prefetch: {e}")
+            hits = {}
+        for key, content in hits.items():
+            self.local_cache.set(key, content, 60)
+        return [url for url in urls if self.cache_key(url) not in hits]
+
+    def fetch_content(self, url):
+        # returns the http response of url, with a pooled key if the api uses a KeyPool
+        if self.key_pool is None:
+            return requests.request("GET", url, timeout=request_timeout())
+        for _ in range(len(self.key_pool)):
+            api_key = self.key_pool.acquire()
+            http_response = requests.request("GET", url.replace(self.key_pool.placeholder, api_key), timeout=request_timeout())
+            if not self.key_pool.is_quota_error(http_response):
+                return http_response
+            self.key_pool.retire(api_key)
+        raise InvalidResponse(f"All api keys in the pool exceeded their quota. url: {url}")
+    
     def str_to_unix(self, time_str):
         time_str = time_str[:10]
         epoch = datetime.datetime(1970, 1, 1)
@@ -63,12 +163,13 @@ class FinancialModelingPrep:
         if type(stop_at) in [int, float]:
             stop_at = self.unix_to_str(stop_at)
         
+        reducer = fields_reducer("date", data_type)
         if interval == "1day":
             url = self.base_path + f"/v3/historical-price-full/{ticker_symbol}?serietype=line&apikey={self.api_key}"
-            response = self.make_request(url)
+            response = self.make_request(url, reducer)
         else:
             url = self.base_path + f"/v3/historical-chart/{interval}/{ticker_symbol}?apikey={self.api_key}"
-            response = self.make_request(url)
+            response = self.make_request(url, reducer)
 
         if interval == "1day":
             response = response["historical"]
@@ -89,13 +190,18 @@ class FinancialModelingPrep:
         return timeseries_dict
         
     def call_stock_data(self, ticker_symbol):
-        stock_data = {"tickerSymbol": ticker_symbol}        
-
         url = self.base_path + f'/v3/balance-sheet-statement/{ticker_symbol}?limit=100&apikey={self.api_key}'
         balance_sheets = self.make_request(url)
-        
-        
-        
+        url = self.base_path + f'/v3/income-statement/{ticker_symbol}?limit=100&apikey={self.api_key}'
+        income_statements = self.make_request(url)
+        url = self.base_path + f'/v3/profile/{ticker_symbol}?limit=100&apikey={self.api_key}'
+        summary = self.make_request(url)[0]
+        return self.build_stock_data(ticker_symbol, balance_sheets, income_statements, summary)
+
+    def build_stock_data(self, ticker_symbol, balance_sheets, income_statements, summary):
+        # assembles call_stock_data from the balance sheet, income statement and profile responses
+        stock_data = {"tickerSymbol": ticker_symbol}        
+
         stock_data["currency"] = balance_sheets[0]["reportedCurrency"]
     
         for balance_sheet in balance_sheets:
@@ -111,10 +217,6 @@ class FinancialModelingPrep:
             if stock_data["currency"] != balance_sheet["reportedCurrency"]:
                 raise InvalidResponse(f'API answer used different currencies <{stock_data["currency"]}> and <{balance_sheet["reportedCurrency"]}>')
             
-        url = self.base_path + f'/v3/income-statement/{ticker_symbol}?limit=100&apikey={self.api_key}'
-        income_statements = self.make_request(url)
-        
-        
         for income_statement in income_statements:
             filling_date = self.str_to_unix(income_statement["fillingDate"])
             if filling_date not in stock_data:
@@ -134,9 +236,6 @@ class FinancialModelingPrep:
             stock_data[filling_date]["createdAt"] = round(time.time())
         
 
-        url = self.base_path + f'/v3/profile/{ticker_symbol}?limit=100&apikey={self.api_key}'
-        summary = self.make_request(url)[0]
-
         if stock_data["currency"] != summary["currency"]:
             raise InvalidResponse(f'API answer used different currencies <{stock_data["currency"]}> and <{summary["reportedCurrency"]}>')
         
@@ -181,7 +280,18 @@ class FinancialModelingPrep:
             raise RuntimeError(f'Difference between requested Date <{self.unix_to_str(unix_time)}> and returned Date <{series["meta"]["stop"]}> is too big.')
         return series["values"][0]
 
+    def load_symbol_index(self, cache_path=None, max_age=60*60*24):
+        # check_exists answers symbols known to the index locally, see SymbolIndex
+        self.symbol_index = SymbolIndex(self, cache_path, max_age)
+        self.symbol_index.refresh_if_stale()
+        return self.symbol_index
+
     def check_exists(self, ticker_symbol):
+        # symbols unknown to the symbol index are not necessarily invalid (it only lists
+        # companies with statements), those are checked against the api
+        # symbols have to be spelled as listed, self.symbol_index.resolve maps other spellings
+        if self.symbol_index is not None and self.symbol_index.contains(ticker_symbol):
+            return True
         try:
             self.get_price(ticker_symbol)
             return True
@@ -201,29 +311,24 @@ class FinancialModelingPrep:
     
     
     
-    ######################################### finish this when the response is there
     def get_earnings_dates(self, ticker_symbol="all", sort_by="company"):
         # ticker_symbol can be the ticker symbol of a company to recieve the next earning
         # date if applicable or "all" to recieve dates for all companies
         # sort by can be "company" or "date"
-        url = self.base_path + f"/v3/earning_calendar?apikey={self.api_key}"
-        response = self.make_request(url)
-        
-        def sort_to_dict(response):
-            earnings_by_company = {}
-            for raw_dict in response:
-                ticker_symbol = raw_dict["symbol"]
-                if ticker_symbol not in earnings_by_company:
-                     earnings_by_company[ticker_symbol] = []
-                earnings_by_company[ticker_symbol].append(raw_dict["date"])
-            return earnings_by_company
+        # answers come from the cached EarningsCalendar which is refreshed incrementally
+        if self.earnings_calendar is None:
+            self.earnings_calendar = EarningsCalendar(self)
+        self.earnings_calendar.refresh_if_stale()
 
+        if ticker_symbol != "all":
+            next_date = self.earnings_calendar.next_earnings(ticker_symbol)
+            if next_date is None:
+                raise InvalidResponse(f"No upcoming earnings date found for <{ticker_symbol}>")
+            return next_date
+        if sort_by == "company":
+            return self.earnings_calendar.by_company()
+        return self.earnings_calendar.between(self.earnings_calendar.start, self.earnings_calendar.end, details=True)
 
-        if ticker_symbol == "all" and sort_by == "company":
-            return sort_to_dict(response)
-            
-        return response
-    
     def get_upcoming_ipo_dates(self):
         
         start_date = self.unix_to_str(time.time())
@@ -293,6 +398,16 @@ class FinancialModelingPrep:
                 timeseries[key].append(r[key])
             timeseries[key].reverse()
         return timeseries
+
+    def get_treasury_curve(self, start, end, cache_path=None, deadline=None, limiter=None):
+        # treasury rates for arbitrary ranges, see TreasuryCurve
+        # returns (dates, tenors, rates) with rates as a (date x tenor) numpy matrix
+        # limiter: RateLimiter shared with other consumers of the api key
+        if self.treasury_curve is None or self.treasury_curve.cache_path != cache_path:
+            self.treasury_curve = TreasuryCurve(self, cache_path=cache_path, limiter=limiter)
+        elif limiter is not None:
+            self.treasury_curve.limiter = limiter
+        return self.treasury_curve.get_rates(start, end, deadline)
         
     def get_all_company_tickers(self):
         url = self.base_path + "/v3/financial-statement-symbol-lists?apikey=" + self.api_key
@@ -366,13 +481,15 @@ class FinancialModelingPrep:
         response = self.get_analyst_estimates(ticker_symbol)
         if direction == "forewards":
             response.reverse()
+        # dates are compared as "YYYY-MM-DD" strings against today (utc like str_to_unix)
+        today = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
         estimates = {}
         for point in response:
             if len(estimates) == n_periods:
                 break
-            if direction == "forewards" and self.str_to_unix(point["date"]) >= time.time():
+            if direction == "forewards" and point["date"][:10] > today:
                 estimates[point["date"]] = point
-            elif direction == "backwards" and self.str_to_unix(point["date"]) <= time.time():
+            elif direction == "backwards" and point["date"][:10] <= today:
                 estimates[point["date"]] = point
 
         if len(estimates) == n_periods:
@@ -384,9 +501,12 @@ class FinancialModelingPrep:
         url = f"{self.base_path}/v3/rating/{ticker_symbol}?apikey={self.api_key}"
         return self.make_request(url)[0]
 
-    def get_currency(self, ticker_symbol):
+    def get_profile(self, ticker_symbol):
         url = f"{self.base_path}/v3/profile/{ticker_symbol}?apikey={self.api_key}"
-        return self.make_request(url)[0]["currency"]
+        return self.make_request(url)[0]
+
+    def get_currency(self, ticker_symbol):
+        return self.get_profile(ticker_symbol)["currency"]
 
     def convert_currency(self, convert_from, convert_to, value):
         # value can be a single value or an iterator of values
@@ -430,13 +550,437 @@ class FinancialModelingPrep:
         return holdings
     """
 
+class EarningsCalendar:
+    # cached index over /v3/earning_calendar
+    # self.dates holds sorted (date, symbol) tuples for range queries, self.symbols holds the
+    # sorted report dates per symbol for "next earnings" lookups. Both are answered via bisect.
+    # the endpoint serves at most ~3 months per request, windows are therefore fetched in evenly
+    # sized chunks of at most window_days. Stale refreshes only fetch the days that moved into
+    # the horizon since the last refresh plus the next revalidate_days, where reports are still
+    # confirmed or moved, and only replace the entries inside the fetched windows
+    def __init__(self, fmp, days_ahead=90, days_back=0, window_days=90, max_age=60*60*12, revalidate_days=7):
+        self.fmp = fmp
+        self.days_ahead = days_ahead
+        self.days_back = days_back
+        self.window_days = window_days
+        self.max_age = max_age
+        self.revalidate_days = revalidate_days
+        # (dates, entries, symbols) swapped as a whole so readers never see a half merged index
+        # entries: (date, symbol) -> raw dict from the api
+        self.state = ([], {}, {})
+        self.start = None  # covered window, dates as "YYYY-MM-DD"
+        self.end = None
+        self.refreshed_at = 0
+        self.lock = threading.Lock()
+
+    @property
+    def dates(self):
+        return self.state[0]
+
+    @property
+    def entries(self):
+        return self.state[1]
+
+    @property
+    def symbols(self):
+        return self.state[2]
+
+    def shift(self, date, days):
+        return (datetime.date.fromisoformat(date) + datetime.timedelta(days=days)).isoformat()
+
+    def fetch_window(self, start, end):
+        # start, end: "YYYY-MM-DD", both inclusive
+        first, last = datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+        n_days = (last - first).days + 1
+        n_chunks = -(-n_days // self.window_days)
+        chunk_days = -(-n_days // n_chunks)
+        response = []
+        chunk_start = first
+        while chunk_start <= last:
+            chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), last)
+            url = (self.fmp.base_path + f"/v3/earning_calendar?from={chunk_start.isoformat()}"
+                   f"&to={chunk_end.isoformat()}&apikey={self.fmp.api_key}")
+            try:
+                response.extend(self.fmp.make_request(url))
+            except EmptyResponse:
+                pass  # no reports scheduled inside this chunk, other errors abort the refresh
+            chunk_start = chunk_end + datetime.timedelta(days=1)
+        return response
+
+    def stale_windows(self, today):
+        # the windows a stale refresh fetches: the next revalidate_days and the days between
+        # the end of the covered window and the horizon, merged if they touch
+        horizon = self.shift(today, self.days_ahead - 1)
+        windows = []
+        if self.revalidate_days > 0:
+            windows.append([today, min(self.shift(today, self.revalidate_days - 1), horizon)])
+        extension = max(self.shift(self.end, 1), today)
+        if extension <= horizon:
+            if windows and extension <= self.shift(windows[-1][1], 1):
+                windows[-1][1] = max(windows[-1][1], horizon)
+            else:
+                windows.append([extension, horizon])
+        return [tuple(window) for window in windows]
+
+    def refresh(self, start=None, end=None):
+        # refetches [start, end] and merges it into the index, entries outside of the window are kept
+        # without start and end the calendar is loaded from today - days_back up to the horizon
+        # (days_ahead days from today) on the first call and updated with stale_windows afterwards
+        if start is not None or end is not None or self.start is None:
+            today = self.fmp.unix_to_str(time.time())
+            if start is None:
+                start = self.shift(today, -self.days_back) if self.start is None else today
+            if end is None:
+                end = self.shift(today, self.days_ahead - 1)
+            if start > end:
+                raise InvalidRequest(f"Start <{start}> is after end <{end}>")
+            windows = [(start, end)]
+        else:
+            windows = self.stale_windows(self.fmp.unix_to_str(time.time()))
+
+        fetched = []
+        for start, end in windows:
+            window = {}
+            for raw_dict in self.fetch_window(start, end):
+                date = raw_dict["date"][:10]
+                if start <= date <= end:
+                    window[(date, raw_dict["symbol"])] = raw_dict
+            fetched.append((start, end, window))
+
+        with self.lock:
+            dates, entries, _ = self.state
+            dates, entries = list(dates), dict(entries)
+            for start, end, window in fetched:
+                lo = bisect.bisect_left(dates, (start,))
+                hi = bisect.bisect_right(dates, (end, "\uffff"))
+                for key in dates[lo:hi]:
+                    del entries[key]
+                dates[lo:hi] = sorted(window)
+                entries.update(window)
+                self.start = start if self.start is None else min(self.start, start)
+                self.end = end if self.end is None else max(self.end, end)
+            symbols = {}
+            for date, symbol in dates:
+                symbols.setdefault(symbol, []).append(date)
+            self.state = (dates, entries, symbols)
+            self.refreshed_at = time.time()
+        return sum(len(window) for _, _, window in fetched)
+
+    def refresh_if_stale(self):
+        if self.start is None or time.time() - self.refreshed_at >= self.max_age:
+            self.refresh()
+
+    def next_earnings(self, ticker_symbol, date=None):
+        # returns the first report date of ticker_symbol on or after date (default today) or None
+        if date is None:
+            date = self.fmp.unix_to_str(time.time())
+        dates = self.state[2].get(ticker_symbol, [])
+        i = bisect.bisect_left(dates, date)
+        if i == len(dates):
+            return None
+        return dates[i]
+
+    def between(self, start, end, details=False):
+        # returns all reports with start <= date <= end sorted by date as (date, symbol) tuples
+        # or the raw api dicts if details is True
+        dates, entries, _ = self.state
+        lo = bisect.bisect_left(dates, (start,))
+        hi = bisect.bisect_right(dates, (end, "\uffff"))
+        keys = dates[lo:hi]
+        if details:
+            return [entries[key] for key in keys]
+        return keys
+
+    def by_company(self):
+        # same format as the old get_earnings_dates: {ticker_symbol: [dates]}
+        return {ticker_symbol: list(dates) for ticker_symbol, dates in self.state[2].items()}
+
+class TreasuryCurve:
+    # long range treasury rates stitched together from /v4/treasury
+    # the endpoint serves ~42 days per request, ranges are split into chunks of window_days
+    # aligned to a fixed grid (days since epoch) so chunks stay identical between calls.
+    # chunks are fetched concurrently under limiter, the RateLimiter shared with the other
+    # consumers of the api key (defaults to the budget of the KeyPool of fmp or to
+    # limit_per_second), and the result is kept as a dense (date x tenor) matrix with NaN for
+    # missing values in self.rates. if cache_path is given the matrix and the completed chunks
+    # are stored there with np.savez (under exactly that name, no ".npz" is appended) and later
+    # calls only fetch the chunks that are missing
+    tenors = ["month1", "month2", "month3", "month6", "year1", "year2", "year3",
+              "year5", "year7", "year10", "year20", "year30"]
+
+    def __init__(self, fmp, cache_path=None, window_days=42, limiter=None, limit_per_second=5, max_workers=5):
+        self.fmp = fmp
+        self.cache_path = cache_path
+        self.window_days = window_days
+        if limiter is None:
+            if fmp.key_pool is not None:
+                limit_per_second = fmp.key_pool.limit_per_second
+            limiter = RateLimiter(1 / limit_per_second)
+        self.limiter = limiter
+        self.max_workers = max_workers
+        self.dates = np.array([], dtype="datetime64[D]")
+        self.rates = np.empty((0, len(self.tenors)))
+        self.chunks = set()  # indices of chunks that are complete, i.e. lie fully in the past
+        self.lock = threading.Lock()
+        if cache_path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                tenors = list(cache["tenors"])
+                if tenors != self.tenors:
+                    warnings.warn(f"Tenors in cache <{self.cache_path}> do not match, ignoring cache.")
+                    return
+                self.dates = cache["dates"].astype("datetime64[D]")
+                self.rates = cache["rates"]
+                self.chunks = set(cache["chunks"].tolist())
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        # through a file object, np.savez would append ".npz" to the path otherwise
+        with open(self.cache_path, "wb") as file:
+            np.savez(file, tenors=np.array(self.tenors), dates=self.dates.astype(np.int64),
+                     rates=self.rates, chunks=np.array(sorted(self.chunks), dtype=np.int64))
+
+    def fetch_chunk(self, chunk):
+        start = np.datetime64(chunk * self.window_days, "D")
+        end = start + self.window_days - 1
+        url = self.fmp.base_path + f"/v4/treasury?from={start}&to={end}&apikey={self.fmp.api_key}"
+        self.limiter.acquire()
+        try:
+            response = self.fmp.make_request(url)
+        except EmptyResponse:
+            response = []  # no trading days inside of the chunk, other errors are raised
+
+        dates = np.array([raw_dict["date"][:10] for raw_dict in response], dtype="datetime64[D]")
+        rates = np.full((len(response), len(self.tenors)), np.nan)
+        for i, raw_dict in enumerate(response):
+            for j, tenor in enumerate(self.tenors):
+                value = raw_dict.get(tenor)
+                if value is not None:
+                    rates[i, j] = value
+        return chunk, (dates, rates)
+
+    def update(self, start, end, deadline=None):
+        # fetches all chunks overlapping [start, end] that are not complete yet
+        # start, end: "YYYY-MM-DD", deadline: seconds the requests may take or None
+        first = int(np.datetime64(start, "D").astype(np.int64)) // self.window_days
+        last = int(np.datetime64(end, "D").astype(np.int64)) // self.window_days
+        today = int(np.datetime64(self.fmp.unix_to_str(time.time()), "D").astype(np.int64))
+        missing = [chunk for chunk in range(first, last + 1) if chunk not in self.chunks]
+        if not missing:
+            return 0
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            results = run_batch(executor, self.fetch_chunk, missing, deadline=deadline)
+        finally:
+            executor.shutdown(wait=False)
+
+        with self.lock:
+            dates = [self.dates] + [dates for dates, _ in results.values()]
+            rates = [self.rates] + [rates for _, rates in results.values()]
+            self.stitch(np.concatenate(dates), np.concatenate(rates))
+            for chunk in results:
+                if (chunk + 1) * self.window_days <= today:
+                    self.chunks.add(chunk)
+            self.save()
+        # failed and timed out chunks stay missing and are fetched again next time
+        if results.timed_out:
+            raise DeadlineExceeded(f"Treasury rates of {len(results.timed_out)} chunks did not arrive before the deadline")
+        failed = [chunk for chunk in missing if chunk not in results and chunk not in results.timed_out]
+        if failed:
+            raise InvalidResponse(f"Treasury rates of {len(failed)} chunks could not be fetched")
+        return len(missing)
+
+    def stitch(self, dates, rates):
+        # sorts by date and removes duplicates, the last occurrence of a date wins
+        # so freshly fetched rows replace cached ones
+        reverse_dates = dates[::-1]
+        unique_dates, index = np.unique(reverse_dates, return_index=True)
+        self.dates = unique_dates
+        self.rates = rates[::-1][index]
+
+    def get_rates(self, start, end, deadline=None):
+        # returns (dates, tenors, rates) for start <= date <= end, rates is a (date x tenor) matrix
+        self.update(start, end, deadline)
+        lo = np.searchsorted(self.dates, np.datetime64(start, "D"), side="left")
+        hi = np.searchsorted(self.dates, np.datetime64(end, "D"), side="right")
+        return self.dates[lo:hi], list(self.tenors), self.rates[lo:hi]
+
+class SymbolIndex:
+    # local index of the symbols of get_all_company_tickers to answer check_exists without
+    # network calls. Membership only matches symbols exactly as the api lists them, so whatever
+    # the index accepts is accepted by the endpoints as well. Other spellings ("brk.b", "VOD.LON")
+    # are mapped to the listed symbol by resolve (see normalize). The symbols are kept in a set
+    # and in a sorted list for prefix search. The index is stored as json in cache_path if given
+    # and refreshed once it is older than max_age seconds, failed refreshes keep the current
+    # index and are retried after retry_seconds, doubling up to max_age
+    exchange_suffixes = {"L", "HK", "NS", "BO", "TO", "V", "DE", "F", "PA", "AS", "BR", "MI", "MC",
+                         "SW", "ST", "OL", "CO", "HE", "VI", "LS", "IR", "AX", "NZ", "SI", "KS",
+                         "KQ", "T", "SS", "SZ", "TW", "TWO", "JK", "KL", "BK", "SA", "MX", "ME",
+                         "IS", "TA", "JO", "CN", "NE", "WA", "PR", "AT", "IC", "SR", "QA", "KW"}
+    suffix_aliases = {"LON": "L", "LN": "L", "NSE": "NS", "BSE": "BO", "TSX": "TO", "ETR": "DE",
+                      "XETRA": "DE", "ASX": "AX", "SIX": "SW", "TYO": "T", "HKG": "HK"}
+
+    def __init__(self, fmp, cache_path=None, max_age=60*60*24, retry_seconds=60):
+        self.fmp = fmp
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.retry_seconds = retry_seconds
+        self.symbols = set()
+        self.sorted_symbols = []
+        self.aliases = {}  # normalized symbol -> listed symbol
+        self.refreshed_at = 0
+        self.retry_at = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        if cache_path is not None:
+            self.load()
+
+    def normalize(self, ticker_symbol):
+        # "brk.b" -> "BRK-B", "700.hk" -> "0700.HK", "VOD.LON" -> "VOD.L"
+        ticker_symbol = ticker_symbol.strip().upper()
+        base, dot, suffix = ticker_symbol.rpartition(".")
+        if not dot:
+            return ticker_symbol
+        suffix = self.suffix_aliases.get(suffix, suffix)
+        if suffix not in self.exchange_suffixes:
+            # share classes are separated with "-" by the api
+            return base.replace(".", "-") + "-" + suffix
+        base = base.replace(".", "-")
+        if suffix == "HK" and base.isdigit():
+            base = base.zfill(4)
+        return base + "." + suffix
+
+    def load(self):
+        try:
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+        except FileNotFoundError:
+            return
+        if "listedSymbols" not in cache:
+            return  # written by an older version with normalized symbols, refreshed instead
+        self.build(cache["listedSymbols"], cache["refreshedAt"])
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        with open(self.cache_path, "w") as file:
+            json.dump({"refreshedAt": self.refreshed_at, "listedSymbols": self.sorted_symbols}, file)
+
+    def build(self, ticker_symbols, refreshed_at):
+        symbols = set(ticker_symbols)
+        aliases = {self.normalize(ticker_symbol): ticker_symbol for ticker_symbol in sorted(symbols)}
+        # swap in complete structures so readers never see a half built index
+        self.sorted_symbols = sorted(symbols)
+        self.aliases = aliases
+        self.symbols = symbols
+        self.refreshed_at = refreshed_at
+
+    def refresh(self):
+        with self.lock:
+            self.build(self.fmp.get_all_company_tickers(), time.time())
+            self.save()
+        return len(self.symbols)
+
+    def refresh_if_stale(self):
+        # never raises, a stale index is better than failing every check_exists
+        now = time.time()
+        if now - self.refreshed_at < self.max_age or now < self.retry_at or self.lock.locked():
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            self.failures += 1
+            backoff = min(self.retry_seconds * 2 ** (self.failures - 1), self.max_age)
+            self.retry_at = time.time() + backoff
+            warnings.warn(f"Refreshing the symbol index failed, keeping the current one and retrying in {backoff:.0f}s: {e}")
+        else:
+            self.failures = 0
+            self.retry_at = 0
+
+    def __contains__(self, ticker_symbol):
+        return ticker_symbol in self.symbols
+
+    def resolve(self, ticker_symbol):
+        # the listed symbol for any spelling of ticker_symbol, e.g. "brk.b" -> "BRK-B", or None
+        if ticker_symbol in self.symbols:
+            return ticker_symbol
+        return self.aliases.get(self.normalize(ticker_symbol))
+
+    def contains(self, ticker_symbol):
+        self.refresh_if_stale()
+        return ticker_symbol in self
+
+    def search(self, prefix, limit=20):
+        # listed symbols starting with prefix, sorted
+        prefix = prefix.strip().upper()
+        symbols = self.sorted_symbols
+        i = bisect.bisect_left(symbols, prefix)
+        found = []
+        while i < len(symbols) and len(found) < limit and symbols[i].startswith(prefix):
+            found.append(symbols[i])
+            i += 1
+        return found
+
+def extract_price_target(response):
+    # reduces the tr payload to the two fields get_price_target needs, module level so it
+    # can run inside of a ProcessPoolDecoder
+    stock = response["common"]["stock"]
+    return {"currency": stock["currency"],
+            "priceTarget": stock["analystRatings"]["bestConsensus"]["priceTarget"]["value"]}
+
 class ReverseEngineered:
-    def __init__(self, fmp_key):
+    def __init__(self, fmp_key, validator_path=None, fresh_for=60):
+        # price targets are stored with the ETag / Last-Modified of their payload and requested
+        # conditionally, unchanged payloads cost a 304 without body. Within fresh_for seconds
+        # the stored price target is used without any request. validator_path: json file to
+        # keep the store between runs, written by flush (the batch methods flush on their own)
         self.executor = ThreadPoolExecutor(max_workers=10)
         self.fmp = FinancialModelingPrep(fmp_key)
+        self.validator_path = validator_path
+        self.fresh_for = fresh_for
+        self.price_targets = {}
+        self.price_targets_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.unflushed = False
+        if validator_path is not None:
+            try:
+                with open(validator_path) as file:
+                    self.price_targets = json.load(file)
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        # writes the stored validators to validator_path if they changed, through a temporary
+        # file that replaces the old one so readers and crashes never see a partial file
+        if self.validator_path is None:
+            return
+        with self.flush_lock:
+            with self.price_targets_lock:
+                if not self.unflushed:
+                    return
+                price_targets = dict(self.price_targets)
+                self.unflushed = False
+            temporary_path = f"{self.validator_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(temporary_path, "w") as file:
+                    json.dump(price_targets, file)
+                os.replace(temporary_path, self.validator_path)
+            except OSError:
+                with self.price_targets_lock:
+                    self.unflushed = True
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                raise
 
     def make_request(self, url):
-        response = requests.get(url).json()
+        response = requests.get(url, timeout=request_timeout()).json()
         if len(response) != 1:
             raise RuntimeError(f"Unexpected response format: {response}")
         response = next(iter(response.values()))
@@ -447,7 +991,7 @@ class ReverseEngineered:
     def get_rank(self, ticker_symbol, internal=False):
         url = r"https://quote-feed.zacks.com/index?t=" + ticker_symbol
 
-        response = requests.get(url).json()
+        response = requests.get(url, timeout=request_timeout()).json()
         if len(response) != 1:
             raise RuntimeError(f"Unexpected response format: {response}")
         response = next(iter(response.values()))
@@ -463,29 +1007,45 @@ class ReverseEngineered:
         else:
             return int(rank)
 
-    def get_ranks(self, ticker_symbols):
-        response, threads = {}, []
-        for ticker_symbol in ticker_symbols:
-            threads.append(self.executor.submit(self.get_rank, ticker_symbol, True))
+    def get_ranks(self, ticker_symbols, deadline=None):
+        # deadline: seconds the batch may take, see run_batch. Tickers that ran out of time
+        # are listed in the timed_out attribute of the returned dict
+        return run_batch(self.executor, self.get_rank, ticker_symbols, True, deadline=deadline)
 
-        for task in as_completed(threads):
-            try:
-                result = task.result()
-                response[result[0]] = result[1]
-            except:
-                print(f"Error occured: {task.exception()}. excluding result from answer.")
-        return response
+    def fetch_price_target(self, ticker_symbol):
+        # returns the stored {"currency", "priceTarget", ...} entry, revalidated if older than fresh_for
+        key = ticker_symbol.lower()
+        entry = self.price_targets.get(key)
+        if entry is not None and time.time() - entry["checkedAt"] < self.fresh_for:
+            return entry
 
-    def get_price_target(self, ticker_symbol, desired_currency="USD", internal=False):
-        url = f"https://tr-frontend-cdn.azureedge.net/bff/prod/stock/{ticker_symbol.lower()}/payload.json"
-        try:
-            response = requests.get(url).json()
-        except json.decoder.JSONDecodeError:
-            raise InvalidResponse(f"Could not decode response, the ticker symbol <{ticker_symbol}> is probably unavailable")
+        headers = {}
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry["lastModified"]:
+            headers["If-Modified-Since"] = entry["lastModified"]
+        url = f"https://tr-frontend-cdn.azureedge.net/bff/prod/stock/{key}/payload.json"
+        http_response = requests.get(url, headers=headers, timeout=request_timeout())
 
+        if http_response.status_code == 304 and entry is not None:
+            entry = dict(entry, checkedAt=time.time())
+        else:
+            try:
+                extracted = self.fmp.decoder.decode(http_response.content, extract_price_target)
+            except ValueError:
+                raise InvalidResponse(f"Could not decode response, the ticker symbol <{ticker_symbol}> is probably unavailable")
+            except (KeyError, TypeError):
+                raise InvalidResponse(f"No price target in response for ticker symbol <{ticker_symbol}>")
+            entry = dict(extracted, etag=http_response.headers.get("ETag"),
+                         lastModified=http_response.headers.get("Last-Modified"), checkedAt=time.time())
+        with self.price_targets_lock:
+            self.price_targets[key] = entry
+            self.unflushed = True
+        return entry
 
-        currency = response["common"]["stock"]["currency"]
-        price_target = response["common"]["stock"]["analystRatings"]["bestConsensus"]["priceTarget"]["value"]
+    def get_price_target(self, ticker_symbol, desired_currency="USD", internal=False):
+        entry = self.fetch_price_target(ticker_symbol)
+        currency, price_target = entry["currency"], entry["priceTarget"]
         if currency != desired_currency:
             price_target = self.fmp.convert_currency(currency, desired_currency, price_target)
 
@@ -494,21 +1054,13 @@ class ReverseEngineered:
         else:
             return price_target
 
-    def get_price_targets(self, ticker_symbols, desired_currency="USD"):
-        response, threads = {}, []
-        for ticker_symbol in ticker_symbols:
-            threads.append(self.executor.submit(self.get_price_target, ticker_symbol, desired_currency, True))
-
-        for task in as_completed(threads):
-            try:
-                result = task.result()
-                response[result[0]] = result[1]
-            except:
-                print(f"Error occured: {task.exception()}. excluding result from answer.")
+    def get_price_targets(self, ticker_symbols, desired_currency="USD", deadline=None):
+        response = run_batch(self.executor, self.get_price_target, ticker_symbols, desired_currency, True, deadline=deadline)
+        self.flush()
         return response
 
     def get_upwards_potential(self, ticker_symbol, internal=False):
-        price_target = self.get_price_target(ticker_symbol)
+        price_target = self.get_price_target(ticker_symbol, internal=True)[1]
         price = self.fmp.get_price(ticker_symbol)
         if price_target is None:
             raise InvalidResponse("Price target cannot be found.")
@@ -517,17 +1069,9 @@ class ReverseEngineered:
         else:
             return (price_target - price) / price
 
-    def get_upward_potentials(self, ticker_symbols):
-        response, threads = {}, []
-        for ticker_symbol in ticker_symbols:
-            threads.append(self.executor.submit(self.get_upwards_potential, ticker_symbol, True))
-
-        for task in as_completed(threads):
-            try:
-                result = task.result()
-                response[result[0]] = result[1]
-            except:
-                print(f"Error occurred: {task.exception()}. excluding result from answer.")
+    def get_upward_potentials(self, ticker_symbols, deadline=None):
+        response = run_batch(self.executor, self.get_upwards_potential, ticker_symbols, True, deadline=deadline)
+        self.flush()
         return response
 
 class APIS:
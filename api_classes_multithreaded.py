@@ -11,8 +11,12 @@ Created on Thu Jun  3 10:13:10 2021
 import time
 import requests
 import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from api.api_classes import FinancialModelingPrep as FinancialModelingPrep_single
+# imported under the same names as api_classes imports them, the deadline set by run_batch lives
+# in a thread local of auxiliary_functions and a second copy of the module would never see it
+from auxiliary_functions import BatchResult, run_batch, run_with_deadline
+from decoding import get_decoder, fields_reducer
 
 class InvalidResponse(Exception):
     def __init__(self, message):
@@ -25,14 +29,23 @@ class InvalidResponse(Exception):
         super().__init__(self.message)
 
 class FinancialModelingPrep:
-    def __init__(self, api_key, limit_per_second):
+    def __init__(self, api_key, limit_per_second=None, decoder=None, cache=None):
+        # api_key can be a single key or a KeyPool, limit_per_second then defaults to the sum of the pool
+        # decoder: see decoding.py, e.g. ProcessPoolDecoder() to decode large payloads outside of the GIL
+        # cache: a CacheBackend from cache.py, e.g. RedisCache to share responses between hosts
+        self.decoder = decoder if decoder is not None else get_decoder()
+        self.single = FinancialModelingPrep_single(api_key, self.decoder, cache)
+        self.key_pool = self.single.key_pool
+        if limit_per_second is None:
+            if self.key_pool is None:
+                raise ValueError("limit_per_second is required for a single api key")
+            limit_per_second = self.key_pool.limit_per_second
         self.limit_per_second = limit_per_second
-        self.api_key = api_key
-        self.single = FinancialModelingPrep_single(self.api_key)
+        self.api_key = self.single.api_key
         self.base_path = "https://financialmodelingprep.com/api"
     
-    def make_request(self, url):
-        response = requests.request("GET", url).json()
+    def make_request(self, url, reducer=None):
+        response = self.decoder.decode(self.single.get_content(url), reducer)
         if not response:
             raise InvalidResponse(f"Invalid Response from API for url <{url}>")
         elif "Error Message" in response:
@@ -71,13 +84,14 @@ class FinancialModelingPrep:
         if type(stop_at) in [int, float]:
             stop_at = self.unix_to_string(stop_at)
         
+        reducer = fields_reducer("date", data_type)
         if interval == "1day":
             url = self.base_path + f"/v3/historical-price-full/{ticker_symbol}?serietype=line&apikey={self.api_key}"
-            response = self.make_request(url)
+            response = self.make_request(url, reducer)
         else:  
         
             url = self.base_path + f"/v3/historical-chart/{interval}/{ticker_symbol}?apikey={self.api_key}"
-            response = self.make_request(url)
+            response = self.make_request(url, reducer)
 
         if interval == "1day":
             response = response["historical"]
@@ -185,28 +199,9 @@ class FinancialModelingPrep:
     
     
     
-    ######################################### finish this when the response is there
     def get_earnings_dates(self, ticker_symbol="all", sort_by="company"):
-        # ticker_symbol can be the ticker symbol of a company to recieve the next earning
-        # date if applicable or "all" to recieve dates for all companies
-        # sort by can be "company" or "date"
-        url = self.base_path + f"/v3/earning_calendar?apikey={self.api_key}"
-        response = self.make_request(url)
-        
-        def sort_to_dict(response):
-            earnings_by_company = {}
-            for raw_dict in response:
-                ticker_symbol = raw_dict["symbol"]
-                if ticker_symbol not in earnings_by_company:
-                     earnings_by_company[ticker_symbol] = []
-                earnings_by_company[ticker_symbol].append(raw_dict["date"])
-            return earnings_by_company
-
-
-        if ticker_symbol == "all" and sort_by == "company":
-            return sort_to_dict(response)
-            
-        return response
+        # served from the cached earnings calendar index of the single threaded class
+        return self.single.get_earnings_dates(ticker_symbol, sort_by)
     
     def get_upcoming_ipo_dates(self):
         
@@ -328,61 +323,42 @@ ticker_symbols = ['DFEN', 'XMA.TO', 'DSSL.NS', 'THS.L', 'KOHINOOR.NS', 'EFF.DE',
                'DLG.DE', 'NNSB.ME', 'VSTIND.NS', 'KOR', 'NONG.OL', 'DTOCU',
                'SKYT']
 
-class RateLimiter: # nice idea but probably not needed
-    def __init__(self, interval):
-        self.interval = interval
-        self.next_call = 0
-
-    def __next__(self):
-        t = time.monotonic()
-        if t < self.next_call:
-            time.sleep(self.next_yield - t)
-            t = time.monotonic()
-        self.next_call = t + self.interval
-
 class MultiThreader:
     def __init__(self, api):
         self.api = api
         self.limit_per_second = self.api.limit_per_second
         self.executor = ThreadPoolExecutor(max_workers=self.limit_per_second)
     
-    def make_request(self, *args, **kwargs):
+    def make_request(self, *args, deadline=None, **kwargs):
         # *args: function, list of ticker symbols
         # **kwargs: kwargs to pass to the function
+        # deadline: seconds the call may take, see run_batch. On expiry the partial result is
+        # returned and the missing ticker symbols are listed in its timed_out attribute
         function = args[0]
         ticker_symbols = False
         if len(args) == 2:
             ticker_symbols = args[1] 
-        response, threads = {}, []
         if kwargs and ticker_symbols:
-            for ticker_symbol in ticker_symbols:
-                threads.append(self.executor.submit(function, ticker_symbol, kwargs))
+            return run_batch(self.executor, function, ticker_symbols, kwargs, deadline=deadline)
         elif ticker_symbols:
-            for ticker_symbol in ticker_symbols:
-                threads.append(self.executor.submit(function, ticker_symbol))
-        elif kwargs:
-            return function(kwargs)
+            return run_batch(self.executor, function, ticker_symbols, deadline=deadline)
+
+        deadline_at = None if deadline is None else time.monotonic() + deadline
+        if kwargs:
+            return run_with_deadline(deadline_at, function, kwargs)
         else:
-            return function()
-        
-        for task in as_completed(threads):
-            try:
-                result = task.result()
-                response[result[0]] = result[1]
-            except:
-                print("Error occured:", task.exception(), "excluding result from answer.")
-        return response
+            return run_with_deadline(deadline_at, function)
     
-    def call_price(self, ticker_symbols):
-        return self.make_request(self.api.call_price, ticker_symbols)
+    def call_price(self, ticker_symbols, deadline=None):
+        return self.make_request(self.api.call_price, ticker_symbols, deadline=deadline)
     
-    def call_timeseries(self, ticker_symbols, interval, starting_time, data_type="close"):
-        return self.make_request(self.api.call_timeseries, ticker_symbols, interval=interval, starting_time=starting_time, data_type=data_type)
+    def call_timeseries(self, ticker_symbols, interval, starting_time, data_type="close", deadline=None):
+        return self.make_request(self.api.call_timeseries, ticker_symbols, interval=interval, starting_time=starting_time, data_type=data_type, deadline=deadline)
     
-    def call_stock_data(self, ticker_symbols):
+    def call_stock_data(self, ticker_symbols, deadline=None):
         try:
             self.executor = ThreadPoolExecutor(max_workers=int(self.limit_per_second*0.7))
-            result = self.make_request(self.api.call_stock_data, ticker_symbols)
+            result = self.make_request(self.api.call_stock_data, ticker_symbols, deadline=deadline)
             self.executor = ThreadPoolExecutor(max_workers=self.limit_per_second)
         except Exception as e:
             self.executor = ThreadPoolExecutor(max_workers=int(self.limit_per_second))
@@ -391,24 +367,58 @@ class MultiThreader:
 
         return result
     
-    def check_exists(self, ticker_symbols):
-        return self.make_request(self.api.check_exists, ticker_symbols)
+    def check_exists(self, ticker_symbols, deadline=None):
+        # symbols known to the symbol index (see load_symbol_index) are answered without a request
+        symbol_index = self.api.single.symbol_index
+        if symbol_index is None:
+            return self.make_request(self.api.check_exists, ticker_symbols, deadline=deadline)
+        symbol_index.refresh_if_stale()
+        known = [ticker_symbol for ticker_symbol in ticker_symbols if ticker_symbol in symbol_index]
+        unknown = [ticker_symbol for ticker_symbol in ticker_symbols if ticker_symbol not in symbol_index]
+        response = self.make_request(self.api.check_exists, unknown, deadline=deadline) if unknown else BatchResult()
+        for ticker_symbol in known:
+            response[ticker_symbol] = True
+        return response
+    
+    def load_symbol_index(self, cache_path=None, max_age=60*60*24):
+        return self.api.single.load_symbol_index(cache_path, max_age)
     
-    def get_shares_info(self, ticker_symbols, share_type="outstandingShares"):
-        return self.make_request(self.api.get_shares_info, ticker_symbols, share_type=share_type)
+    def get_shares_info(self, ticker_symbols, share_type="outstandingShares", deadline=None):
+        return self.make_request(self.api.get_shares_info, ticker_symbols, share_type=share_type, deadline=deadline)
     
     def get_upcoming_ipo_dates(self):
         return self.api.single.get_upcoming_ipo_dates()
     
-    def get_gainers_losers(self, minimum_change=0.1, mode="both"):
-        return self.make_request(self.api.get_gainers_losers, minimum_change=minimum_change, mode=mode)
+    def get_gainers_losers(self, minimum_change=0.1, mode="both", deadline=None):
+        return self.make_request(self.api.get_gainers_losers, minimum_change=minimum_change, mode=mode, deadline=deadline)
     
-    def get_sentiment(self, ticker_symbols):
-        return self.make_request(self.api.get_sentiment, ticker_symbols)
+    def get_sentiment(self, ticker_symbols, deadline=None):
+        return self.make_request(self.api.get_sentiment, ticker_symbols, deadline=deadline)
     
     def get_treasury_rates(self, days_back):
         return self.api.single.get_treasury_rates(days_back)
     
     def get_all_company_tickers(self):
         return self.api.single.get_all_company_tickers()
+    
+    def prefetch_url(self, url):
+        return url, self.api.single.get_content(url)
 
+    def prefetch(self, path, ticker_symbols, deadline=None):
+        # path: endpoint with a {ticker_symbol} field, e.g. "/v3/profile/{ticker_symbol}?limit=100"
+        # all cached responses are fetched with one multi get, the rest concurrently from the api
+        # so that later calls for the same urls are answered locally. deadline: seconds the
+        # requests to the api may take, urls that did not finish are simply not prefetched
+        urls = []
+        for ticker_symbol in ticker_symbols:
+            url = self.api.base_path + path.format(ticker_symbol=ticker_symbol)
+            urls.append(url + ("&" if "?" in url else "?") + f"apikey={self.api.api_key}")
+        missing = self.api.single.prefetch(urls)
+        run_batch(self.executor, self.prefetch_url, missing, deadline=deadline)
+        return len(urls) - len(missing)
+    
+    def get_key_usage(self):
+        # per key usage if the api was created with a KeyPool
+        if self.api.key_pool is None:
+            return {}
+        return self.api.key_pool.usage()
@@ -1,4 +1,8 @@
 import yaml
+import time
+import threading
+import requests
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
 
 def is_number(val):
     if isinstance(val, bool):
@@ -12,3 +16,94 @@ def is_number(val):
         except TypeError:
             return False
 
+class RateLimiter:
+    # spaces calls at least interval seconds apart, can be shared between threads
+    # usage: limiter = RateLimiter(1 / limit_per_second); limiter.acquire() before every request
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        # reserves n consecutive slots at once, the n calls may then be sent together
+        with self.lock:
+            t = time.monotonic()
+            wait = self.next_call - t
+            self.next_call = max(t, self.next_call) + self.interval * n
+        if wait > 0:
+            time.sleep(wait)
+
+    def __next__(self):
+        self.acquire()
+
+class DeadlineExceeded(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class BatchResult(dict):
+    # {ticker_symbol: result} like before, plus the ticker symbols that ran out of time
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timed_out = []
+
+deadline_state = threading.local()
+
+def request_timeout(default=30):
+    # socket timeout for the next request of this thread: default or the remaining time of
+    # the deadline set by run_with_deadline, whatever is smaller
+    deadline = getattr(deadline_state, "deadline", None)
+    if deadline is None:
+        return default
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded before the request was sent")
+    return min(default, remaining)
+
+def run_with_deadline(deadline, function, *args):
+    # deadline: time.monotonic() based timestamp or None
+    previous = getattr(deadline_state, "deadline", None)
+    deadline_state.deadline = deadline
+    try:
+        if deadline is not None and deadline <= time.monotonic():
+            raise DeadlineExceeded("Deadline exceeded before the task started")
+        return function(*args)
+    finally:
+        deadline_state.deadline = previous
+
+def run_batch(executor, function, ticker_symbols, *args, deadline=None):
+    # runs function(ticker_symbol, *args) for every ticker on executor, function has to return
+    # (ticker_symbol, result). deadline: seconds the whole batch may take or None.
+    # when the deadline expires tasks that have not started are cancelled, running ones are
+    # bounded by request_timeout and the partial results are returned. Ticker symbols without
+    # a result because of the deadline are listed in BatchResult.timed_out
+    deadline_at = None if deadline is None else time.monotonic() + deadline
+    threads = {}
+    for ticker_symbol in ticker_symbols:
+        threads[executor.submit(run_with_deadline, deadline_at, function, ticker_symbol, *args)] = ticker_symbol
+
+    response, collected = BatchResult(), set()
+    def collect(task):
+        collected.add(task)
+        try:
+            result = task.result()
+            response[result[0]] = result[1]
+        except (DeadlineExceeded, requests.exceptions.Timeout):
+            response.timed_out.append(threads[task])
+        except:
+            print(f"Error occured: {task.exception()}. excluding result from answer.")
+
+    timeout = None if deadline_at is None else max(0, deadline_at - time.monotonic())
+    try:
+        for task in as_completed(threads, timeout=timeout):
+            collect(task)
+    except FuturesTimeoutError:
+        for task, ticker_symbol in threads.items():
+            if task in collected:
+                continue
+            if task.done() and not task.cancelled():
+                collect(task)
+            else:
+                task.cancel()
+                response.timed_out.append(ticker_symbol)
+    return response
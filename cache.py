@@ -0,0 +1,181 @@
+# cache backends for raw api responses shared between threads, processes and hosts
+# usage: FinancialModelingPrep(api_key, cache=RedisCache("cache-host"))
+# values are the raw response bodies, compressed with zlib above compress_threshold bytes.
+# keys are built by the api classes from the url without the api key, so every worker of a
+# fleet shares the same entries no matter which key it uses.
+
+import time
+import zlib
+import socket
+import threading
+
+
+class CacheError(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def serialize(content, compress_threshold):
+    if len(content) >= compress_threshold:
+        return b"z" + zlib.compress(content)
+    return b"r" + content
+
+
+def deserialize(value):
+    if value is None:
+        return None
+    if value[:1] == b"z":
+        return zlib.decompress(value[1:])
+    return value[1:]
+
+
+class CacheBackend:
+    # interface of all backends, get_many and set_many should be overridden with batched versions
+    def get(self, key):
+        # returns the cached bytes or None
+        raise NotImplementedError
+
+    def set(self, key, content, ttl=None):
+        # ttl in seconds, None for no expiry
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        # returns {key: bytes} for all keys that are cached
+        response = {}
+        for key in keys:
+            content = self.get(key)
+            if content is not None:
+                response[key] = content
+        return response
+
+    def set_many(self, items, ttl=None):
+        # items: dict {key: bytes}
+        for key, content in items.items():
+            self.set(key, content, ttl)
+
+
+class MemoryCache(CacheBackend):
+    # per process cache, mostly useful as a local layer in front of a shared backend
+    def __init__(self, compress_threshold=1 << 16):
+        self.compress_threshold = compress_threshold
+        self.entries = {}  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            with self.lock:
+                self.entries.pop(key, None)
+            return None
+        return deserialize(entry[1])
+
+    def set(self, key, content, ttl=None):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            self.entries[key] = (expires_at, serialize(content, self.compress_threshold))
+
+
+class RedisCache(CacheBackend):
+    # speaks the redis protocol (RESP) over a plain socket, one connection per thread
+    # works with redis and any server implementing GET, SET (with EX), MGET, AUTH and SELECT
+    def __init__(self, host="localhost", port=6379, db=0, password=None, prefix="finapi:",
+                 timeout=5, compress_threshold=1024, batch_size=500):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.compress_threshold = compress_threshold
+        self.batch_size = batch_size
+        self.local = threading.local()
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.local.sock = sock
+        self.local.reader = sock.makefile("rb")
+        if self.password is not None:
+            self.execute([["AUTH", self.password]])
+        if self.db:
+            self.execute([["SELECT", self.db]])
+
+    def close(self):
+        if getattr(self.local, "sock", None) is not None:
+            self.local.reader.close()
+            self.local.sock.close()
+            self.local.sock = None
+
+    def encode(self, command):
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def read_reply(self):
+        line = self.local.reader.readline()
+        if not line:
+            raise CacheError(f"Connection to <{self.host}:{self.port}> closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        elif kind == b"-":
+            raise CacheError(f"Redis error: {payload.decode(errors='replace')}")
+        elif kind == b":":
+            return int(payload)
+        elif kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self.local.reader.read(length + 2)
+            return data[:-2]
+        elif kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise CacheError(f"Unexpected reply from <{self.host}:{self.port}>: {line}")
+
+    def execute(self, commands):
+        # sends all commands in one write (pipelining) and returns their replies
+        if getattr(self.local, "sock", None) is None:
+            self.connect()
+        try:
+            self.local.sock.sendall(b"".join(self.encode(command) for command in commands))
+            return [self.read_reply() for _ in commands]
+        except (OSError, CacheError):
+            self.close()
+            raise
+
+    def get(self, key):
+        return deserialize(self.execute([["GET", self.prefix + key]])[0])
+
+    def set(self, key, content, ttl=None):
+        self.set_many({key: content}, ttl)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        response = {}
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i:i + self.batch_size]
+            values = self.execute([["MGET"] + [self.prefix + key for key in batch]])[0]
+            for key, value in zip(batch, values):
+                if value is not None:
+                    response[key] = deserialize(value)
+        return response
+
+    def set_many(self, items, ttl=None):
+        commands = []
+        for key, content in items.items():
+            command = ["SET", self.prefix + key, serialize(content, self.compress_threshold)]
+            if ttl is not None:
+                command += ["EX", max(1, int(ttl))]
+            commands.append(command)
+        for i in range(0, len(commands), self.batch_size):
+            self.execute(commands[i:i + self.batch_size])
@@ -0,0 +1,128 @@
+# pluggable json decoding for api responses
+# large payloads (historical-price-full, 1min historical-chart, 100 period statements) are
+# decoded while holding the GIL which serializes the worker threads of MultiThreader.
+# get_decoder returns the fastest installed backend, ProcessPoolDecoder additionally moves
+# payloads above a size threshold into a process pool and can reduce them to the needed
+# fields there so only the reduced result is sent back.
+# run "python decoding.py" for a benchmark on synthetic 1min historical-chart payloads
+
+import json
+import time
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonDecoder:
+    # stdlib backend, decoders raise ValueError (or a subclass) on invalid payloads
+    name = "json"
+
+    def loads(self, content):
+        return json.loads(content)
+
+    def decode(self, content, reducer=None):
+        # reducer is an optional function applied to the decoded payload
+        data = self.loads(content)
+        if reducer is not None:
+            data = reducer(data)
+        return data
+
+
+class OrjsonDecoder(JsonDecoder):
+    name = "orjson"
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+
+def get_decoder(name=None):
+    # name can be "json", "orjson" or None for the fastest installed backend
+    if name is None:
+        name = "json" if orjson is None else "orjson"
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        return OrjsonDecoder()
+    elif name == "json":
+        return JsonDecoder()
+    raise ValueError(f"Unknown decoder <{name}>")
+
+
+class ProcessPoolDecoder(JsonDecoder):
+    # decodes payloads of at least threshold bytes in a process pool, smaller ones in the
+    # calling thread. The reducer has to be picklable (a module level function or a
+    # functools.partial of one, like keep_fields) as it runs in the worker process
+    name = "process_pool"
+
+    def __init__(self, decoder=None, threshold=1 << 20, max_workers=None):
+        self.decoder = decoder if decoder is not None else get_decoder()
+        self.threshold = threshold
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()  # decode is called from many threads at once
+
+    def loads(self, content):
+        return self.decode(content)
+
+    def decode(self, content, reducer=None):
+        if len(content) < self.threshold:
+            return self.decoder.decode(content, reducer)
+        return self.get_executor().submit(self.decoder.decode, content, reducer).result()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+def keep_fields(data, fields):
+    # reduces lists of data points to fields, for dicts (historical-price-full) every list
+    # value is reduced and the other values are kept
+    if isinstance(data, dict):
+        return {key: keep_fields(value, fields) if isinstance(value, list) else value for key, value in data.items()}
+    return [{field: point[field] for field in fields if field in point} if isinstance(point, dict) else point
+            for point in data]
+
+
+def fields_reducer(*fields):
+    # picklable reducer keeping only fields, e.g. fields_reducer("date", "close")
+    return functools.partial(keep_fields, fields=fields)
+
+
+def benchmark(n_payloads=40, n_points=20000, n_threads=20):
+    point = {"date": "2021-11-08 15:59:00", "open": 150.12, "low": 150.01, "high": 150.33,
+             "close": 150.2, "volume": 123456}
+    content = json.dumps([point] * n_points).encode()
+    reducer = fields_reducer("date", "close")
+    print(f"{n_payloads} payloads of {len(content) / 1e6:.1f} MB, {n_threads} threads")
+
+    decoders = [JsonDecoder()]
+    if orjson is not None:
+        decoders.append(OrjsonDecoder())
+    decoders.append(ProcessPoolDecoder(JsonDecoder(), threshold=0))
+    for decoder in decoders:
+        for use_reducer in [False, True]:
+            decoder.decode(content, reducer if use_reducer else None)  # warm up the pool
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                list(executor.map(lambda c: decoder.decode(c, reducer if use_reducer else None), [content] * n_payloads))
+            elapsed = time.perf_counter() - started
+            print(f"{decoder.name:>13} reduced={use_reducer!s:<5} {elapsed:6.2f}s {n_payloads / elapsed:6.1f} payloads/s")
+        if isinstance(decoder, ProcessPoolDecoder):
+            decoder.shutdown()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,146 @@
+# analyst estimates for many tickers packed into one numpy array
+# Documentation is at: https://financialmodelingprep.com/developer/docs/
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from api_classes import InvalidResponse, InvalidRequest
+from auxiliary_functions import run_batch
+
+
+class AnalystEstimatesCube:
+    # fetches /v3/analyst-estimates concurrently for a list of tickers and packs them into
+    # self.values, a dense (ticker x period x metric) float cube with NaN for missing values.
+    # the axes are self.ticker_symbols, self.dates (sorted datetime64[D] of all periods) and
+    # self.metrics. Every load keeps the cube before it in self.previous (and in cache_path if
+    # given, stored under exactly that name) so revisions of the estimates can be tracked between
+    # loads and runs.
+    def __init__(self, fmp, cache_path=None, max_workers=10):
+        self.fmp = fmp
+        self.cache_path = cache_path
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.ticker_symbols = []
+        self.dates = np.array([], dtype="datetime64[D]")
+        self.metrics = []
+        self.values = np.empty((0, 0, 0))
+        self.previous = None
+        self.timed_out = []  # ticker symbols of the last load that ran out of time
+        if cache_path is not None:
+            self.previous = self.load_cache()
+
+    def load_cache(self):
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                return {"ticker_symbols": list(cache["ticker_symbols"]),
+                        "dates": cache["dates"].astype("datetime64[D]"),
+                        "metrics": list(cache["metrics"]),
+                        "values": cache["values"]}
+        except FileNotFoundError:
+            return None
+
+    def save_cache(self):
+        if self.cache_path is None:
+            return
+        # through a file object, np.savez would append ".npz" to the path otherwise
+        with open(self.cache_path, "wb") as file:
+            np.savez(file, ticker_symbols=np.array(self.ticker_symbols, dtype=str),
+                     dates=self.dates.astype(np.int64), metrics=np.array(self.metrics, dtype=str),
+                     values=self.values)
+
+    def fetch(self, ticker_symbol):
+        return ticker_symbol, self.fmp.get_analyst_estimates(ticker_symbol)
+
+    def load(self, ticker_symbols, deadline=None):
+        # fetches all tickers and replaces the cube, tickers without estimates are excluded
+        # deadline: seconds the load may take, tickers cut off by it are listed in self.timed_out
+        responses = run_batch(self.executor, self.fetch, ticker_symbols, deadline=deadline)
+        self.timed_out = responses.timed_out
+        if not responses:
+            raise InvalidResponse("Analyst Estimates not available for any of the ticker symbols.")
+
+        ticker_symbols = [ticker_symbol for ticker_symbol in ticker_symbols if ticker_symbol in responses]
+        dates, metrics = set(), {}
+        for response in responses.values():
+            for point in response:
+                dates.add(point["date"][:10])
+                for key, value in point.items():
+                    if key not in ("symbol", "date") and (value is None or isinstance(value, (int, float))):
+                        metrics.setdefault(key, None)
+        dates = np.array(sorted(dates), dtype="datetime64[D]")
+        metrics = list(metrics)
+        metric_index = {metric: j for j, metric in enumerate(metrics)}
+
+        values = np.full((len(ticker_symbols), len(dates), len(metrics)), np.nan)
+        for i, ticker_symbol in enumerate(ticker_symbols):
+            response = responses[ticker_symbol]
+            periods = np.searchsorted(dates, np.array([point["date"][:10] for point in response], dtype="datetime64[D]"))
+            for period, point in zip(periods, response):
+                for key, value in point.items():
+                    j = metric_index.get(key)
+                    if j is not None and value is not None:
+                        values[i, period, j] = value
+
+        if len(self.ticker_symbols):
+            self.previous = {"ticker_symbols": self.ticker_symbols, "dates": self.dates,
+                             "metrics": self.metrics, "values": self.values}
+        self.ticker_symbols, self.dates, self.metrics, self.values = ticker_symbols, dates, metrics, values
+        self.save_cache()
+        return self
+
+    def select(self, direction="forewards", n_periods=4, date=None):
+        # returns (dates, values) with the n_periods next ("forewards", date excluded) or last
+        # ("backwards", date included) periods with estimates of every ticker, date defaults
+        # to today. dates is (ticker x n_periods) with NaT, values is
+        # (ticker x n_periods x metric) with NaN where a ticker has less than n_periods periods
+        if direction not in ("forewards", "backwards"):
+            raise InvalidRequest(f"Invalid direction <{direction}>")
+        date = np.datetime64("today" if date is None else date, "D")
+
+        available = ~np.isnan(self.values).all(axis=2)
+        if direction == "forewards":
+            order = np.arange(len(self.dates))
+            eligible = available & (self.dates > date)[None, :]
+        else:
+            order = np.arange(len(self.dates))[::-1]
+            eligible = (available & (self.dates <= date)[None, :])[:, order]
+        # rank of every eligible period per ticker, counted in walking direction
+        rank = np.cumsum(eligible, axis=1)
+        chosen = eligible & (rank <= n_periods)
+
+        dates = np.full((len(self.ticker_symbols), n_periods), np.datetime64("NaT"), dtype="datetime64[D]")
+        values = np.full((len(self.ticker_symbols), n_periods, len(self.metrics)), np.nan)
+        rows, columns = np.nonzero(chosen)
+        slots = rank[rows, columns] - 1
+        periods = order[columns]
+        dates[rows, slots] = self.dates[periods]
+        values[rows, slots] = self.values[rows, periods]
+        return dates, values
+
+    def align(self, other):
+        # reindexes a cube dict like self.previous onto the axes of the current cube
+        aligned = np.full(self.values.shape, np.nan)
+        ticker_index = {ticker_symbol: i for i, ticker_symbol in enumerate(other["ticker_symbols"])}
+        metric_index = {metric: j for j, metric in enumerate(other["metrics"])}
+        rows = np.array([ticker_index.get(ticker_symbol, -1) for ticker_symbol in self.ticker_symbols], dtype=int)
+        metrics = np.array([metric_index.get(metric, -1) for metric in self.metrics], dtype=int)
+        periods = np.searchsorted(other["dates"], self.dates)
+        periods_found = periods < len(other["dates"])
+        periods_found[periods_found] = other["dates"][periods[periods_found]] == self.dates[periods_found]
+
+        row_mask, metric_mask = rows >= 0, metrics >= 0
+        if not row_mask.any() or not periods_found.any() or not metric_mask.any():
+            return aligned
+        aligned[np.ix_(row_mask, periods_found, metric_mask)] = other["values"][
+            np.ix_(rows[row_mask], periods[periods_found], metrics[metric_mask])]
+        return aligned
+
+    def revisions(self):
+        # returns (absolute, relative) changes of every estimate against the previous cube,
+        # NaN where the estimate did not exist in both cubes
+        if self.previous is None:
+            raise InvalidRequest("No previous cube available to compute revisions.")
+        previous = self.align(self.previous)
+        absolute = self.values - previous
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = absolute / np.abs(previous)
+        relative[~np.isfinite(relative)] = np.nan
+        return absolute, relative
@@ -0,0 +1,79 @@
+# spreads requests over several api keys, each with its own rate budget
+# usage: FinancialModelingPrep(KeyPool({"key1": 10, "key2": 5}))
+# urls are built with KeyPool.placeholder instead of a real key, make_request swaps in the key
+# with the most remaining budget right before the request is sent. That also keeps the keys
+# out of error messages.
+
+import time
+import threading
+
+
+class KeyPool:
+    placeholder = "__pooled_api_key__"
+
+    def __init__(self, keys, retire_seconds=60):
+        # keys: dict {api_key: limit_per_second} or list of (api_key, limit_per_second)
+        # retire_seconds: how long a key that ran into its quota is left out
+        keys = dict(keys)
+        if not keys:
+            raise ValueError("KeyPool needs at least one api key")
+        self.retire_seconds = retire_seconds
+        self.lock = threading.Lock()
+        self.keys = {}
+        now = time.monotonic()
+        for api_key, limit_per_second in keys.items():
+            # token bucket per key, holding at most one second worth of requests
+            self.keys[api_key] = {"limitPerSecond": limit_per_second, "tokens": float(limit_per_second),
+                                  "refilledAt": now, "retiredUntil": 0, "requests": 0, "quotaErrors": 0}
+
+    @property
+    def limit_per_second(self):
+        return sum(key["limitPerSecond"] for key in self.keys.values())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def refill(self, key, now):
+        key["tokens"] = min(key["limitPerSecond"], key["tokens"] + (now - key["refilledAt"]) * key["limitPerSecond"])
+        key["refilledAt"] = now
+
+    def acquire(self):
+        # blocks until a key has budget left and returns the one with the most remaining budget
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                active = [(api_key, key) for api_key, key in self.keys.items() if key["retiredUntil"] <= now]
+                if not active:
+                    wait = min(key["retiredUntil"] for key in self.keys.values()) - now
+                else:
+                    for _, key in active:
+                        self.refill(key, now)
+                    api_key, key = max(active, key=lambda item: item[1]["tokens"] / item[1]["limitPerSecond"])
+                    if key["tokens"] >= 1:
+                        key["tokens"] -= 1
+                        key["requests"] += 1
+                        return api_key
+                    wait = min((1 - key["tokens"]) / key["limitPerSecond"] for _, key in active)
+            time.sleep(max(wait, 0.001))
+
+    def retire(self, api_key, seconds=None):
+        # takes api_key out of rotation, e.g. after a quota error
+        with self.lock:
+            key = self.keys[api_key]
+            key["quotaErrors"] += 1
+            key["retiredUntil"] = time.monotonic() + (self.retire_seconds if seconds is None else seconds)
+
+    def is_quota_error(self, http_response):
+        # fmp answers with 429 or with an "Error Message" starting with "Limit Reach"
+        return http_response.status_code == 429 or b"Limit Reach" in http_response.content[:200]
+
+    def usage(self):
+        # per key usage, keys are shortened to their first and last four characters
+        now = time.monotonic()
+        report = {}
+        with self.lock:
+            for api_key, key in self.keys.items():
+                report[f"{api_key[:4]}...{api_key[-4:]}"] = {
+                    "limitPerSecond": key["limitPerSecond"], "requests": key["requests"],
+                    "quotaErrors": key["quotaErrors"], "retiredFor": max(0, round(key["retiredUntil"] - now, 1))}
+        return report
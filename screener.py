@@ -0,0 +1,236 @@
+# universe wide screening on the ttm ratios of /v3/ratios-ttm
+# Documentation is at: https://financialmodelingprep.com/developer/docs/
+
+import re
+import time
+import operator
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from api_classes import InvalidRequest
+from auxiliary_functions import run_batch
+
+
+comparisons = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+               "==": operator.eq, "!=": operator.ne}
+token_pattern = re.compile(r"\s*(?:(<=|>=|==|!=|<|>|&|\||~|\(|\))"
+                           r"|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*))")
+
+
+def tokenize(expression):
+    tokens, position = [], 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = token_pattern.match(expression, position)
+        if match is None:
+            raise InvalidRequest(f"Invalid expression <{expression}> at position {position}")
+        symbol, number, name = match.groups()
+        if symbol is not None:
+            tokens.append(("symbol", symbol))
+        elif number is not None:
+            tokens.append(("number", float(number)))
+        else:
+            tokens.append(("name", name))
+        position = match.end()
+    return tokens
+
+
+def evaluate(expression, columns):
+    # evaluates a filter expression like "peRatioTTM < 15 & (returnOnEquityTTM > 0.1 | ~(currentRatioTTM < 1))"
+    # comparisons take ratio names and numbers, "&", "|" and "~" combine them, nothing else is
+    # allowed. NaN fails every comparison and therefore passes its negation.
+    # columns: {ratio: column vector}, returns a boolean vector
+    tokens, position = tokenize(expression), 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def take(kind=None, value=None):
+        nonlocal position
+        token = peek()
+        if token[0] is None or (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            expected = value or kind or "more input"
+            raise InvalidRequest(f"Invalid expression <{expression}>, expected {expected} instead of <{token[1]}>")
+        position += 1
+        return token
+
+    def operand():
+        kind, value = take()
+        if kind == "number":
+            return value
+        if kind == "name":
+            if value not in columns:
+                raise InvalidRequest(f"Unknown ratio <{value}>")
+            return columns[value]
+        raise InvalidRequest(f"Invalid expression <{expression}>, expected a ratio or number instead of <{value}>")
+
+    def factor():
+        if peek() == ("symbol", "~"):
+            take()
+            return ~factor()
+        if peek() == ("symbol", "("):
+            take()
+            result = disjunction()
+            take("symbol", ")")
+            return result
+        left = operand()
+        kind, value = take("symbol")
+        if value not in comparisons:
+            raise InvalidRequest(f"Invalid expression <{expression}>, expected a comparison instead of <{value}>")
+        return np.asarray(comparisons[value](left, operand()), dtype=bool)
+
+    def conjunction():
+        result = factor()
+        while peek() == ("symbol", "&"):
+            take()
+            result = result & factor()
+        return result
+
+    def disjunction():
+        result = conjunction()
+        while peek() == ("symbol", "|"):
+            take()
+            result = result | conjunction()
+        return result
+
+    result = disjunction()
+    if position != len(tokens):
+        raise InvalidRequest(f"Invalid expression <{expression}>, unexpected <{tokens[position][1]}>")
+    return result
+
+
+class RatioScreener:
+    # keeps the ttm ratios of a ticker universe in self.values, a (ticker x ratio) float matrix
+    # with NaN for missing values. Rows are self.ticker_symbols, columns self.ratios, the sector
+    # of every row (from the profile) is in self.sectors and the load time in self.loaded_at.
+    # refresh only refetches rows that are older than max_age seconds.
+    def __init__(self, fmp, max_age=60*60*24, max_workers=10):
+        self.fmp = fmp
+        self.max_age = max_age
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.ticker_symbols = []
+        self.index = {}
+        self.ratios = []
+        self.values = np.empty((0, 0))
+        self.sectors = np.array([], dtype=object)
+        self.loaded_at = np.array([])
+        self.timed_out = []  # ticker symbols of the last load that ran out of time
+
+    def fetch(self, ticker_symbol):
+        ratios = self.fmp.get_ratios(ticker_symbol)
+        # the sector of loaded rows is reused, only new tickers need their profile
+        row = self.index.get(ticker_symbol)
+        sector = None if row is None else self.sectors[row]
+        if sector is None:
+            sector = self.fmp.get_profile(ticker_symbol).get("sector") or None
+        return ticker_symbol, (ratios, sector)
+
+    def load(self, ticker_symbols, deadline=None):
+        # fetches ticker_symbols and adds or replaces their rows, failing tickers are excluded
+        # deadline: seconds the load may take, tickers cut off by it are listed in self.timed_out
+        responses = run_batch(self.executor, self.fetch, ticker_symbols, deadline=deadline)
+        self.timed_out = responses.timed_out
+        if not responses:
+            return 0
+
+        ratios = {ratio: None for ratio in self.ratios}
+        for response, _ in responses.values():
+            for key, value in response.items():
+                if key != "symbol" and (value is None or isinstance(value, (int, float))):
+                    ratios.setdefault(key, None)
+        ratios = list(ratios)
+        new = [ticker_symbol for ticker_symbol in ticker_symbols if ticker_symbol in responses and ticker_symbol not in self.index]
+
+        values = np.full((len(self.ticker_symbols) + len(new), len(ratios)), np.nan)
+        values[:len(self.ticker_symbols), :len(self.ratios)] = self.values
+        sectors = np.concatenate([self.sectors, np.full(len(new), None, dtype=object)])
+        loaded_at = np.concatenate([self.loaded_at, np.zeros(len(new))])
+        for ticker_symbol in new:
+            self.index[ticker_symbol] = len(self.ticker_symbols)
+            self.ticker_symbols.append(ticker_symbol)
+
+        now = time.time()
+        for ticker_symbol, (response, sector) in responses.items():
+            i = self.index[ticker_symbol]
+            values[i] = [np.nan if response.get(ratio) is None else response[ratio] for ratio in ratios]
+            sectors[i] = sector
+            loaded_at[i] = now
+
+        self.ratios, self.values, self.sectors, self.loaded_at = ratios, values, sectors, loaded_at
+        return len(responses)
+
+    def refresh(self, ticker_symbols=None, deadline=None):
+        # loads all tickers of ticker_symbols (default: the whole universe) that are not
+        # loaded yet or older than max_age
+        if ticker_symbols is None:
+            ticker_symbols = self.ticker_symbols
+        now = time.time()
+        stale = [ticker_symbol for ticker_symbol in ticker_symbols
+                 if ticker_symbol not in self.index or now - self.loaded_at[self.index[ticker_symbol]] >= self.max_age]
+        if stale:
+            self.load(stale, deadline)
+        return stale
+
+    def column(self, ratio):
+        try:
+            return self.values[:, self.ratios.index(ratio)]
+        except ValueError:
+            raise InvalidRequest(f"Unknown ratio <{ratio}>")
+
+    def mask(self, expression):
+        # expression is either a string like "peRatioTTM < 15 & returnOnEquityTTM > 0.1" (see
+        # evaluate) or a callable that receives a dict {ratio: column} and returns a boolean
+        # vector. NaN never passes a comparison.
+        columns = {ratio: self.values[:, j] for j, ratio in enumerate(self.ratios)}
+        with np.errstate(invalid="ignore"):
+            if callable(expression):
+                mask = expression(columns)
+            else:
+                mask = evaluate(expression, columns)
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != (len(self.ticker_symbols),):
+            raise InvalidRequest(f"Expression <{expression}> did not evaluate to one value per ticker")
+        return mask
+
+    def filter(self, expression):
+        # returns the ticker symbols matching expression, see mask
+        mask = self.mask(expression)
+        return [ticker_symbol for ticker_symbol, keep in zip(self.ticker_symbols, mask) if keep]
+
+    def percentile_ranks(self):
+        # (ticker x ratio) matrix of percentile ranks in [0, 1] per ratio, tied values share
+        # their average rank, NaN stays NaN
+        ranks = np.full(self.values.shape, np.nan)
+        for j in range(self.values.shape[1]):
+            column = self.values[:, j]
+            valid = ~np.isnan(column)
+            count = valid.sum()
+            if not count:
+                continue
+            ordered = np.sort(column[valid])
+            left = np.searchsorted(ordered, column[valid], side="left")
+            right = np.searchsorted(ordered, column[valid], side="right")
+            average = (left + right - 1) / 2
+            ranks[valid, j] = average / (count - 1) if count > 1 else 0.5
+        return ranks
+
+    def sector_zscores(self):
+        # (ticker x ratio) matrix of z-scores relative to the other tickers of the same sector,
+        # NaN for missing values, tickers without sector and sectors without variance
+        sectors = np.array(["" if sector is None else sector for sector in self.sectors])
+        names, groups = np.unique(sectors, return_inverse=True)
+        valid = ~np.isnan(self.values)
+        filled = np.where(valid, self.values, 0)
+
+        counts = np.zeros((len(names), len(self.ratios)))
+        sums = np.zeros((len(names), len(self.ratios)))
+        squares = np.zeros((len(names), len(self.ratios)))
+        np.add.at(counts, groups, valid)
+        np.add.at(sums, groups, filled)
+        np.add.at(squares, groups, filled ** 2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = sums / counts
+            stds = np.sqrt(np.maximum(squares / counts - means ** 2, 0))
+            zscores = (self.values - means[groups]) / stds[groups]
+        zscores[~np.isfinite(zscores)] = np.nan
+        zscores[sectors == ""] = np.nan
+        return zscores
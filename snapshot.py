@@ -0,0 +1,266 @@
+# declarative multi source snapshots: request fields for a ticker list and get one record per ticker
+# usage: SnapshotPipeline(fmp).snapshot(["AAPL", "MSFT"], ["price", "marketCap", "ratios", "rank"])
+# the pipeline plans the upstream calls (resources) the fields need, every resource is fetched
+# once per ticker no matter how many fields use it, quotes and profiles are fetched for many
+# tickers per request and exchange rates once per currency pair. All calls run as one dependency
+# graph on a single executor.
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from api_classes import InvalidResponse, InvalidRequest, ReverseEngineered
+from auxiliary_functions import BatchResult, run_with_deadline
+
+
+class SnapshotPipeline:
+    # resource: (method, batch_size or None for one request per ticker, resources it depends on)
+    # batched methods take a list of ticker symbols and return {ticker_symbol: payload} with the
+    # symbols upper case, the others take (ticker_symbol, dependencies) and return the payload
+    resources = {
+        "quote": ("fetch_quotes", 500, ()),
+        "profile": ("fetch_profiles", 100, ()),
+        "balanceSheets": ("fetch_balance_sheets", None, ()),
+        "incomeStatements": ("fetch_income_statements", None, ()),
+        "ratios": ("fetch_ratios", None, ()),
+        "sentiment": ("fetch_sentiment", None, ()),
+        "sharesFloat": ("fetch_shares_float", None, ()),
+        "rank": ("fetch_rank", None, ()),
+        "priceTarget": ("fetch_price_target", None, ()),
+        "priceTargetLocal": ("convert_price_target", None, ("priceTarget", "profile")),
+    }
+    # resources computed from their dependencies, they make no request of their own
+    derived = {"priceTargetLocal"}
+    # field: (resources, extractor), extractors get the dict of resource payloads of one ticker
+    fields = {
+        "price": (("quote",), lambda p: p["quote"]["price"]),
+        "volume": (("quote",), lambda p: p["quote"]["volume"]),
+        "currency": (("profile",), lambda p: p["profile"]["currency"]),
+        "companyName": (("profile",), lambda p: p["profile"]["companyName"]),
+        "country": (("profile",), lambda p: p["profile"]["country"]),
+        "industry": (("profile",), lambda p: p["profile"]["industry"]),
+        "sector": (("profile",), lambda p: p["profile"]["sector"]),
+        "exchangeShortName": (("profile",), lambda p: p["profile"]["exchangeShortName"]),
+        "fullTimeEmployees": (("profile",), lambda p: p["profile"]["fullTimeEmployees"]),
+        "image": (("profile",), lambda p: p["profile"]["image"]),
+        "longBusinessSummary": (("profile",), lambda p: p["profile"]["description"]),
+        "marketCap": (("profile",), lambda p: p["profile"]["mktCap"]),
+        "totalShares": (("profile",), lambda p: round(p["profile"]["mktCap"] / p["profile"]["price"])),
+        "ratios": (("ratios",), lambda p: p["ratios"]),
+        "sentiment": (("sentiment",), lambda p: {"relativeActivity": p["sentiment"]["relativeIndex"],
+                                                 "relativeBullish": p["sentiment"]["generalPerception"],
+                                                 "percentBullish": p["sentiment"]["sentiment"]}),
+        "outstandingShares": (("sharesFloat",), lambda p: int(p["sharesFloat"]["outstandingShares"])),
+        "floatShares": (("sharesFloat",), lambda p: int(p["sharesFloat"]["floatShares"])),
+        "freeFloat": (("sharesFloat",), lambda p: p["sharesFloat"]["freeFloat"]),
+        "rank": (("rank",), lambda p: p["rank"]),
+        # price target in the listing currency (the currency of the profile / quote)
+        "priceTarget": (("priceTargetLocal",), lambda p: p["priceTargetLocal"]),
+        "upwardsPotential": (("priceTargetLocal", "quote"),
+                             lambda p: (p["priceTargetLocal"] - p["quote"]["price"]) / p["quote"]["price"]),
+    }
+
+    def __init__(self, fmp, reverse_engineered=None, max_workers=20, fx_ttl=60):
+        # fx_ttl: seconds an exchange rate is shared between tickers and snapshots
+        self.fmp = fmp
+        self.reverse_engineered = reverse_engineered
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.fx_ttl = fx_ttl
+        self.fx_rates = {}  # (convert_from, convert_to) -> (fetched_at, rate)
+        self.fx_locks = {}
+        self.fx_lock = threading.Lock()
+
+    def get_reverse_engineered(self):
+        if self.reverse_engineered is None:
+            self.reverse_engineered = ReverseEngineered(self.fmp.key_pool or self.fmp.api_key)
+        return self.reverse_engineered
+
+    def fetch_quotes(self, ticker_symbols):
+        url = self.fmp.base_path + f"/v3/quote-short/{','.join(ticker_symbols)}?apikey={self.fmp.api_key}"
+        return {raw_dict["symbol"].upper(): raw_dict for raw_dict in self.fmp.make_request(url)}
+
+    def fetch_profiles(self, ticker_symbols):
+        url = self.fmp.base_path + f"/v3/profile/{','.join(ticker_symbols)}?apikey={self.fmp.api_key}"
+        return {raw_dict["symbol"].upper(): raw_dict for raw_dict in self.fmp.make_request(url)}
+
+    def fetch_balance_sheets(self, ticker_symbol, dependencies):
+        url = self.fmp.base_path + f"/v3/balance-sheet-statement/{ticker_symbol}?limit=100&apikey={self.fmp.api_key}"
+        return self.fmp.make_request(url)
+
+    def fetch_income_statements(self, ticker_symbol, dependencies):
+        url = self.fmp.base_path + f"/v3/income-statement/{ticker_symbol}?limit=100&apikey={self.fmp.api_key}"
+        return self.fmp.make_request(url)
+
+    def fetch_ratios(self, ticker_symbol, dependencies):
+        return self.fmp.get_ratios(ticker_symbol)
+
+    def fetch_sentiment(self, ticker_symbol, dependencies):
+        url = self.fmp.base_path + f"/v4/social-sentiment?symbol={ticker_symbol}&limit=100&apikey={self.fmp.api_key}"
+        return self.fmp.make_request(url)[0]
+
+    def fetch_shares_float(self, ticker_symbol, dependencies):
+        url = self.fmp.base_path + f"/v4/shares_float?symbol={ticker_symbol}&apikey={self.fmp.api_key}"
+        return self.fmp.make_request(url)[0]
+
+    def fetch_rank(self, ticker_symbol, dependencies):
+        return self.get_reverse_engineered().get_rank(ticker_symbol)
+
+    def fetch_price_target(self, ticker_symbol, dependencies):
+        return self.get_reverse_engineered().fetch_price_target(ticker_symbol)
+
+    def convert_price_target(self, ticker_symbol, dependencies):
+        price_target, currency = dependencies["priceTarget"]["priceTarget"], dependencies["priceTarget"]["currency"]
+        if price_target is None:
+            raise InvalidResponse("Price target cannot be found.")
+        return price_target * self.get_fx_rate(currency, dependencies["profile"]["currency"])
+
+    def get_fx_rate(self, convert_from, convert_to):
+        # exchange rates are shared by all tickers, concurrent callers of the same pair wait for
+        # the first one so every pair costs one request per fx_ttl seconds
+        if convert_from == convert_to:
+            return 1
+        pair = (convert_from, convert_to)
+        with self.fx_lock:
+            lock = self.fx_locks.setdefault(pair, threading.Lock())
+        with lock:
+            cached = self.fx_rates.get(pair)
+            if cached is not None and time.monotonic() - cached[0] < self.fx_ttl:
+                return cached[1]
+            rate = self.fmp.convert_currency(convert_from, convert_to, 1)
+            self.fx_rates[pair] = (time.monotonic(), rate)
+            return rate
+
+    def plan(self, fields):
+        # returns the resources needed for fields, dependencies first
+        planned = []
+        def add(resource):
+            if resource in planned:
+                return
+            for dependency in self.resources[resource][2]:
+                add(dependency)
+            planned.append(resource)
+        for field in fields:
+            if field == "financials":
+                resources = ("balanceSheets", "incomeStatements", "profile")
+            elif field in self.fields:
+                resources = self.fields[field][0]
+            else:
+                raise InvalidRequest(f"Unknown field <{field}>")
+            for resource in resources:
+                add(resource)
+        return planned
+
+    def count_requests(self, fields, n_tickers):
+        # number of upstream requests snapshot makes for n_tickers (plus one per currency pair
+        # that price targets are converted with)
+        count = 0
+        for resource in self.plan(fields):
+            if resource in self.derived:
+                continue
+            batch_size = self.resources[resource][1]
+            count += n_tickers if batch_size is None else -(-n_tickers // batch_size)
+        return count
+
+    def snapshot(self, ticker_symbols, fields, deadline=None):
+        # returns {ticker_symbol: {field: value}}, fields that could not be served are None
+        # and their error messages are in the "errors" entry of the record.
+        # "financials" is the call_stock_data dict. deadline: seconds the snapshot may take,
+        # tickers with resources still pending on expiry are listed in the timed_out attribute
+        ticker_symbols = list(dict.fromkeys(ticker_symbols))
+        planned = self.plan(fields)
+        deadline_at = None if deadline is None else time.monotonic() + deadline
+        payloads = {ticker_symbol: {} for ticker_symbol in ticker_symbols}
+        errors = {ticker_symbol: {} for ticker_symbol in ticker_symbols}
+        threads = {}
+
+        def submit(resource, ticker_symbol):
+            method = getattr(self, self.resources[resource][0])
+            dependencies = {dependency: payloads[ticker_symbol][dependency] for dependency in self.resources[resource][2]}
+            threads[self.executor.submit(run_with_deadline, deadline_at, method, ticker_symbol, dependencies)] = (resource, [ticker_symbol])
+
+        def submit_ready(ticker_symbol):
+            # submits the dependent resources of ticker_symbol whose dependencies are resolved
+            for resource in planned:
+                _, batch_size, dependencies = self.resources[resource]
+                if not dependencies or resource in payloads[ticker_symbol] or resource in errors[ticker_symbol]:
+                    continue
+                if (resource, ticker_symbol) in submitted:
+                    continue
+                if any(dependency in errors[ticker_symbol] for dependency in dependencies):
+                    errors[ticker_symbol][resource] = "dependency failed"
+                elif all(dependency in payloads[ticker_symbol] for dependency in dependencies):
+                    submitted.add((resource, ticker_symbol))
+                    submit(resource, ticker_symbol)
+
+        submitted = set()
+        for resource in planned:
+            method, batch_size, dependencies = self.resources[resource]
+            if dependencies:
+                continue
+            if batch_size is None:
+                for ticker_symbol in ticker_symbols:
+                    submit(resource, ticker_symbol)
+            else:
+                for i in range(0, len(ticker_symbols), batch_size):
+                    batch = ticker_symbols[i:i + batch_size]
+                    task = self.executor.submit(run_with_deadline, deadline_at, getattr(self, method), batch)
+                    threads[task] = (resource, batch)
+
+        pending = set(threads)
+        while pending:
+            timeout = None if deadline_at is None else max(0, deadline_at - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                resource, batch = threads[task]
+                try:
+                    result = task.result()
+                except Exception as e:
+                    for ticker_symbol in batch:
+                        errors[ticker_symbol][resource] = str(e)
+                else:
+                    for ticker_symbol in batch:
+                        if self.resources[resource][1] is None:
+                            payloads[ticker_symbol][resource] = result
+                        elif ticker_symbol.upper() in result:
+                            payloads[ticker_symbol][resource] = result[ticker_symbol.upper()]
+                        else:
+                            errors[ticker_symbol][resource] = "missing in batched response"
+                for ticker_symbol in batch:
+                    before = len(threads)
+                    submit_ready(ticker_symbol)
+                    pending.update(list(threads)[before:])
+
+        if self.reverse_engineered is not None:
+            self.reverse_engineered.flush()
+
+        response = BatchResult()
+        for task in pending:
+            task.cancel()
+            for ticker_symbol in threads[task][1]:
+                if ticker_symbol not in response.timed_out:
+                    response.timed_out.append(ticker_symbol)
+
+        for ticker_symbol in ticker_symbols:
+            record, record_errors = {}, {}
+            for field in fields:
+                try:
+                    if field == "financials":
+                        p = payloads[ticker_symbol]
+                        record[field] = self.fmp.build_stock_data(ticker_symbol, p["balanceSheets"], p["incomeStatements"], p["profile"])
+                    else:
+                        record[field] = self.fields[field][1](payloads[ticker_symbol])
+                except Exception as e:
+                    record[field] = None
+                    needed = self.plan([field])
+                    failed = [resource for resource in needed if resource in errors[ticker_symbol]]
+                    if failed:
+                        record_errors[field] = "; ".join(f"{resource}: {errors[ticker_symbol][resource]}" for resource in failed)
+                    elif any(resource not in payloads[ticker_symbol] for resource in needed):
+                        record_errors[field] = "timed out"
+                    else:
+                        record_errors[field] = f"{type(e).__name__}: {e}"
+            if record_errors:
+                record["errors"] = record_errors
+            response[ticker_symbol] = record
+        return response
@@ -0,0 +1,14 @@
+import os
+import sys
+import importlib.util
+
+# the modules import each other by their plain names (from cache import ...)
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# api_classes_multithreaded imports the repository as the package "api" (its checkout name)
+if "api" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("api", os.path.join(root, "__init__.py"),
+                                                  submodule_search_locations=[root])
+    sys.modules["api"] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules["api"])
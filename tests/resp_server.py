@@ -0,0 +1,81 @@
+# minimal in-memory stand-in for a redis server, implements the commands RedisCache uses
+# (GET, SET with EX, MGET, AUTH, SELECT) so the cache can be tested without a redis install
+# usage: server = RespServer(); server.start(); RedisCache("127.0.0.1", server.port)
+
+import time
+import threading
+import socketserver
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def bulk(self, value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            server.commands.append(command.decode())
+            if command == b"GET":
+                self.wfile.write(self.bulk(server.lookup(args[1])))
+            elif command == b"MGET":
+                replies = [self.bulk(server.lookup(key)) for key in args[1:]]
+                self.wfile.write(b"*%d\r\n" % len(replies) + b"".join(replies))
+            elif command == b"SET":
+                expires_at = None
+                if len(args) >= 5 and args[3].upper() == b"EX":
+                    expires_at = time.time() + int(args[4])
+                with server.lock:
+                    server.store[args[1]] = (args[2], expires_at)
+                self.wfile.write(b"+OK\r\n")
+            elif command in (b"AUTH", b"SELECT"):
+                self.wfile.write(b"+OK\r\n")
+            else:
+                self.wfile.write(b"-ERR unknown command '%s'\r\n" % command)
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), RespHandler)
+        self.store = {}  # key -> (value, expires_at)
+        self.commands = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.store.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self.store[key]
+                return None
+            return entry[0]
+
+    def ttl(self, key):
+        # remaining seconds of key, None without expiry
+        expires_at = self.store[key][1]
+        return None if expires_at is None else expires_at - time.time()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
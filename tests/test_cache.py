@@ -0,0 +1,66 @@
+import pytest
+from types import SimpleNamespace
+from resp_server import RespServer
+from cache import RedisCache, MemoryCache
+from api_classes import FinancialModelingPrep
+
+
+@pytest.fixture
+def server():
+    server = RespServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(server):
+    cache = RedisCache("127.0.0.1", server.port, compress_threshold=16)
+    yield cache
+    cache.close()
+
+
+def test_get_set_round_trip(cache, server):
+    cache.set("short", b"abc")
+    cache.set("long", b"x" * 1000)
+    assert cache.get("short") == b"abc"
+    assert cache.get("long") == b"x" * 1000
+    assert cache.get("missing") is None
+    # values above compress_threshold are stored compressed under the prefix
+    assert server.store[b"finapi:long"][0][:1] == b"z"
+    assert server.store[b"finapi:short"][0] == b"rabc"
+
+
+def test_set_with_ttl_sends_ex(cache, server):
+    cache.set("expiring", b"abc", ttl=60)
+    cache.set("fractional", b"abc", ttl=0.2)
+    cache.set("forever", b"abc")
+    assert 59 < server.ttl(b"finapi:expiring") <= 60
+    assert 0 < server.ttl(b"finapi:fractional") <= 1
+    assert server.ttl(b"finapi:forever") is None
+
+
+def test_get_many_uses_batched_mget(server):
+    cache = RedisCache("127.0.0.1", server.port, batch_size=2)
+    items = {f"key{i}": f"value{i}".encode() for i in range(5)}
+    cache.set_many(items, ttl=60)
+    server.commands.clear()
+    assert cache.get_many(list(items) + ["missing"]) == items
+    assert server.commands == ["MGET"] * 3
+    cache.close()
+
+
+def test_get_content_caches_only_successful_responses(cache):
+    fmp = FinancialModelingPrep("key", cache=cache)
+    url = fmp.base_path + "/v3/profile/AAPL?apikey=key"
+    answers = [SimpleNamespace(status_code=429, content=b'{"message": "Too Many Requests"}'),
+               SimpleNamespace(status_code=200, content=b'[{"symbol": "AAPL"}]')]
+    fmp.fetch_content = lambda url: answers.pop(0)
+
+    assert fmp.get_content(url) == b'{"message": "Too Many Requests"}'
+    assert cache.get(fmp.cache_key(url)) is None
+    assert fmp.get_content(url) == b'[{"symbol": "AAPL"}]'
+    assert cache.get(fmp.cache_key(url)) == b'[{"symbol": "AAPL"}]'
+    # served from the cache from now on
+    fmp.local_cache = MemoryCache()
+    assert fmp.get_content(url) == b'[{"symbol": "AAPL"}]'
@@ -0,0 +1,91 @@
+import sys
+import time
+import threading
+import pytest
+import requests
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from auxiliary_functions import DeadlineExceeded, request_timeout, run_with_deadline, run_batch
+from api.api_classes_multithreaded import FinancialModelingPrep, MultiThreader
+
+
+def test_run_batch_returns_partial_results_and_cancels_waiting_tasks():
+    started = []
+    def work(ticker_symbol):
+        started.append(ticker_symbol)
+        if ticker_symbol == "SLOW":
+            time.sleep(0.5)
+        return ticker_symbol, ticker_symbol.lower()
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    began = time.monotonic()
+    response = run_batch(executor, work, ["FAST", "SLOW", "NEVER"], deadline=0.2)
+    assert time.monotonic() - began < 0.4
+    assert response == {"FAST": "fast"}
+    assert sorted(response.timed_out) == ["NEVER", "SLOW"]
+    executor.shutdown(wait=True)
+    assert "NEVER" not in started
+
+
+def test_run_batch_excludes_errors_without_timing_them_out():
+    def work(ticker_symbol):
+        if ticker_symbol == "BAD":
+            raise ValueError("broken")
+        return ticker_symbol, 1
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        response = run_batch(executor, work, ["GOOD", "BAD"], deadline=5)
+    assert response == {"GOOD": 1} and response.timed_out == []
+
+
+def test_request_timeout_follows_the_deadline():
+    assert request_timeout() == 30
+    assert run_with_deadline(time.monotonic() + 1, request_timeout) <= 1
+    assert run_with_deadline(time.monotonic() + 100, request_timeout) == 30
+    with pytest.raises(DeadlineExceeded):
+        run_with_deadline(time.monotonic() + 0.05, lambda: (time.sleep(0.1), request_timeout()))
+    assert request_timeout() == 30  # the deadline does not leak out of run_with_deadline
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    # stubs the http layer, requests for "SLOW" take 0.3 seconds
+    sent = []
+    lock = threading.Lock()
+    def request(method, url, timeout=None, **kwargs):
+        with lock:
+            sent.append((url, timeout))
+        if "SLOW" in url:
+            time.sleep(0.3)
+        symbol = url.split("/v3/quote-short/")[-1].split("?")[0]
+        return SimpleNamespace(status_code=200, content=b'[{"symbol": "%s", "price": 1.0}]' % symbol.encode())
+    monkeypatch.setattr(requests, "request", request)
+    return sent
+
+
+def test_multithreader_caps_request_timeouts(sent):
+    threader = MultiThreader(FinancialModelingPrep("key", 5))
+    assert threader.call_price(["AAPL"], deadline=1.0) == {"AAPL": 1.0}
+    assert sent[0][1] <= 1.0
+    threader.call_price(["AAPL"])
+    assert sent[1][1] == 30
+
+
+def test_deadline_exceeded_inside_api_classes_counts_as_timed_out(sent, capsys):
+    fmp = FinancialModelingPrep("key", 5)
+    def price_twice(ticker_symbol):
+        # the first request uses up the budget, request_timeout of api_classes refuses the second
+        def prices():
+            fmp.call_price("SLOW")
+            return fmp.call_price(ticker_symbol)
+        return run_with_deadline(time.monotonic() + 0.1, prices)
+    response = MultiThreader(fmp).make_request(price_twice, ["AAPL"])
+    assert response == {} and response.timed_out == ["AAPL"]
+    assert len(sent) == 1
+    assert "Error occured" not in capsys.readouterr().out
+
+
+def test_one_deadline_state_for_all_modules():
+    import auxiliary_functions
+    import api.api_classes_multithreaded as multithreaded
+    assert sys.modules["api.api_classes"].request_timeout is auxiliary_functions.request_timeout
+    assert multithreaded.run_batch is auxiliary_functions.run_batch
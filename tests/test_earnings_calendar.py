@@ -0,0 +1,95 @@
+import datetime
+import pytest
+from urllib.parse import urlparse, parse_qs
+from api_classes import FinancialModelingPrep, EarningsCalendar, EmptyResponse
+
+
+class FakeCalendarApi:
+    # serves /v3/earning_calendar from self.reports and records the requested windows
+    def __init__(self, today):
+        self.today = today
+        self.reports = []
+        self.windows = []
+
+    def make_request(self, url):
+        query = parse_qs(urlparse(url).query)
+        start, end = query["from"][0], query["to"][0]
+        self.windows.append((start, end))
+        response = [report for report in self.reports if start <= report["date"] <= end]
+        if not response:
+            raise EmptyResponse(f"Invalid Response from API for url <{url}>")
+        return response
+
+
+def day(offset, today="2027-01-01"):
+    return (datetime.date.fromisoformat(today) + datetime.timedelta(days=offset)).isoformat()
+
+
+@pytest.fixture
+def api():
+    api = FakeCalendarApi(day(0))
+    fmp = FinancialModelingPrep("key")
+    fmp.make_request = api.make_request
+    fmp.unix_to_str = lambda unix_time: api.today
+    api.fmp = fmp
+    return api
+
+
+def test_first_refresh_is_one_request_per_horizon(api):
+    api.reports = [{"date": day(5), "symbol": "AAPL"}, {"date": day(89), "symbol": "MSFT"},
+                   {"date": day(90), "symbol": "LATE"}]
+    calendar = EarningsCalendar(api.fmp)
+    assert calendar.refresh() == 2
+    assert api.windows == [(day(0), day(89))]
+    assert calendar.between(day(0), day(100)) == [(day(5), "AAPL"), (day(89), "MSFT")]
+
+
+def test_chunks_are_evenly_sized(api):
+    calendar = EarningsCalendar(api.fmp, window_days=30)
+    calendar.refresh(day(0), day(90))
+    lengths = [(datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start)).days + 1
+               for start, end in api.windows]
+    assert len(lengths) == 4 and sum(lengths) == 91
+    assert max(lengths) - min(lengths) <= 1
+    assert all(api.windows[i][0] == day(sum(lengths[:i])) for i in range(4))
+
+
+def test_stale_refresh_fetches_only_new_days_and_revalidation_window(api):
+    api.reports = [{"date": day(2), "symbol": "AAPL"}, {"date": day(3), "symbol": "MOVED"},
+                   {"date": day(30), "symbol": "MSFT"}]
+    calendar = EarningsCalendar(api.fmp, revalidate_days=7)
+    calendar.refresh()
+
+    # one day later AAPL is cancelled, MOVED reports two days later and a report got added
+    # at the horizon, MSFT is outside of both windows and must be kept untouched
+    api.today, api.windows = day(1), []
+    api.reports = [{"date": day(5), "symbol": "MOVED"}, {"date": day(90), "symbol": "NEW"}]
+    calendar.refresh()
+    assert api.windows == [(day(1), day(7)), (day(90), day(90))]
+    assert calendar.between(day(0), day(100)) == [(day(5), "MOVED"), (day(30), "MSFT"), (day(90), "NEW")]
+    assert calendar.by_company() == {"MOVED": [day(5)], "MSFT": [day(30)], "NEW": [day(90)]}
+    assert calendar.next_earnings("AAPL") is None
+    assert calendar.next_earnings("MSFT") == day(30)
+    assert [entry["symbol"] for entry in calendar.between(day(0), day(100), details=True)] == ["MOVED", "MSFT", "NEW"]
+    assert (calendar.start, calendar.end) == (day(0), day(90))
+
+
+def test_adjacent_windows_are_merged(api):
+    calendar = EarningsCalendar(api.fmp, revalidate_days=7)
+    calendar.refresh()
+    api.today, api.windows = day(85), []
+    calendar.refresh()
+    assert api.windows == [(day(85), day(85 + 89))]
+
+
+def test_failed_refresh_keeps_the_index(api):
+    api.reports = [{"date": day(2), "symbol": "AAPL"}]
+    calendar = EarningsCalendar(api.fmp)
+    calendar.refresh()
+
+    def fail(url):
+        raise ValueError("Limit Reach")
+    api.fmp.make_request = fail
+    with pytest.raises(ValueError):
+        calendar.refresh()
+    assert calendar.between(day(0), day(10)) == [(day(2), "AAPL")]
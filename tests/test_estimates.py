@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+from estimates import AnalystEstimatesCube
+from api_classes import InvalidRequest
+
+
+class FakeEstimatesApi:
+    def __init__(self, estimates):
+        self.estimates = estimates
+
+    def get_analyst_estimates(self, ticker_symbol):
+        return self.estimates[ticker_symbol]
+
+
+def point(date, eps, revenue=None):
+    return {"symbol": "X", "date": date, "estimatedEpsAvg": eps, "estimatedRevenueAvg": revenue}
+
+
+ESTIMATES = {
+    "AAPL": [point("2024-12-31", 4.0, 100.0), point("2023-12-31", 3.0, 90.0), point("2022-12-31", 2.0, 80.0)],
+    "MSFT": [point("2024-06-30", 9.0), point("2022-06-30", 7.0)],
+}
+
+
+def test_cube_axes_and_values():
+    cube = AnalystEstimatesCube(FakeEstimatesApi(ESTIMATES)).load(["AAPL", "MSFT"])
+    assert cube.ticker_symbols == ["AAPL", "MSFT"]
+    assert cube.metrics == ["estimatedEpsAvg", "estimatedRevenueAvg"]
+    assert list(cube.dates.astype(str)) == ["2022-06-30", "2022-12-31", "2023-12-31", "2024-06-30", "2024-12-31"]
+    np.testing.assert_array_equal(cube.values[0, :, 0], [np.nan, 2.0, 3.0, np.nan, 4.0])
+    np.testing.assert_array_equal(cube.values[1, :, 1], [np.nan] * 5)
+
+
+def test_select_forewards_and_backwards():
+    cube = AnalystEstimatesCube(FakeEstimatesApi(ESTIMATES)).load(["AAPL", "MSFT"])
+    dates, values = cube.select("forewards", n_periods=2, date="2023-01-01")
+    assert dates.astype(str).tolist() == [["2023-12-31", "2024-12-31"], ["2024-06-30", "NaT"]]
+    np.testing.assert_array_equal(values[:, :, 0], [[3.0, 4.0], [9.0, np.nan]])
+
+    # backwards includes the date itself and walks into the past, newest first
+    dates, values = cube.select("backwards", n_periods=2, date="2023-12-31")
+    assert dates.astype(str).tolist() == [["2023-12-31", "2022-12-31"], ["2022-06-30", "NaT"]]
+    np.testing.assert_array_equal(values[:, :, 0], [[3.0, 2.0], [7.0, np.nan]])
+
+    with pytest.raises(InvalidRequest):
+        cube.select("sideways")
+
+
+def test_align_reindexes_onto_the_current_axes():
+    cube = AnalystEstimatesCube(FakeEstimatesApi(ESTIMATES)).load(["AAPL", "MSFT"])
+    other = {"ticker_symbols": ["MSFT", "GOOG"],
+             "dates": np.array(["2022-06-30", "2024-06-30", "2025-06-30"], dtype="datetime64[D]"),
+             "metrics": ["estimatedRevenueAvg", "estimatedEpsAvg"],
+             "values": np.arange(18, dtype=float).reshape(2, 3, 3)}
+    aligned = cube.align(other)
+    assert aligned.shape == cube.values.shape
+    assert np.isnan(aligned[0]).all()  # AAPL is not in other
+    np.testing.assert_array_equal(aligned[1, :, 0], [1.0, np.nan, np.nan, 4.0, np.nan])
+    np.testing.assert_array_equal(aligned[1, :, 1], [0.0, np.nan, np.nan, 3.0, np.nan])
+
+
+def test_revisions_survive_a_restart(tmp_path):
+    path = str(tmp_path / "cube")
+    AnalystEstimatesCube(FakeEstimatesApi(ESTIMATES), cache_path=path).load(["AAPL", "MSFT"])
+    assert os.path.exists(path) and not os.path.exists(path + ".npz")
+
+    revised = {ticker_symbol: [dict(p) for p in points] for ticker_symbol, points in ESTIMATES.items()}
+    revised["AAPL"][0]["estimatedEpsAvg"] = 5.0
+    cube = AnalystEstimatesCube(FakeEstimatesApi(revised), cache_path=path)
+    assert cube.previous is not None
+    absolute, relative = cube.load(["AAPL", "MSFT"]).revisions()
+    assert absolute[0, 4, 0] == 1.0 and relative[0, 4, 0] == 0.25
+    assert np.nansum(np.abs(absolute)) == 1.0
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from api_classes import FinancialModelingPrep, InvalidResponse, InvalidRequest, EmptyResponse
+from watchers import QuotePoller
+
+
+class FakeQuoteApi:
+    # answers /v3/quote-short with the next price of every requested symbol
+    def __init__(self):
+        self.price = 0.0
+        self.error = None
+
+    def make_request(self, url):
+        if self.error is not None:
+            raise self.error
+        self.price += 1
+        symbols = url.split("/v3/quote-short/")[1].split("?")[0].split(",")
+        return [{"symbol": symbol.upper(), "price": self.price, "volume": 10} for symbol in symbols]
+
+
+@pytest.fixture
+def api():
+    api = FakeQuoteApi()
+    api.fmp = FinancialModelingPrep("key")
+    api.fmp.make_request = api.make_request
+    return api
+
+
+def test_window_wraps_around_the_ring_buffer(api):
+    poller = QuotePoller(api.fmp, capacity=4)
+    poller.subscribe(["AAPL"])
+    for _ in range(6):
+        poller.poll()
+    timestamps, prices, volumes = poller.window("AAPL")
+    np.testing.assert_array_equal(prices, [3, 4, 5, 6])
+    assert np.all(np.diff(timestamps) >= 0)
+    np.testing.assert_array_equal(poller.window("AAPL", n_ticks=2)[1], [5, 6])
+    np.testing.assert_array_equal(poller.window("AAPL", n_ticks=10)[1], [3, 4, 5, 6])
+    assert poller.latest("AAPL")[1] == 6
+
+
+def test_window_before_wraparound(api):
+    poller = QuotePoller(api.fmp, capacity=4)
+    poller.subscribe(["AAPL"])
+    with pytest.raises(InvalidRequest):
+        poller.latest("AAPL")  # subscriptions are applied by the next poll
+    poller.poll()
+    poller.poll()
+    np.testing.assert_array_equal(poller.window("AAPL")[1], [1, 2])
+
+
+def test_lowercase_subscriptions_receive_ticks(api):
+    poller = QuotePoller(api.fmp)
+    poller.subscribe(["aapl", "AAPL", " msft "])
+    poller.poll()
+    assert poller.ticker_symbols == ["AAPL", "MSFT"]
+    assert poller.latest("aapl")[1] == 1
+    assert poller.latest("MSFT")[1] == 1
+    with pytest.raises(InvalidRequest):
+        poller.latest("GOOG")
+
+
+def test_api_errors_are_raised_empty_responses_are_not(api):
+    poller = QuotePoller(api.fmp)
+    poller.subscribe(["AAPL"])
+    api.error = EmptyResponse("Invalid Response from API")
+    poller.poll()
+    assert poller.latest("AAPL") is None
+
+    api.error = InvalidResponse("Limit Reach . Please upgrade your plan")
+    with pytest.raises(InvalidResponse):
+        poller.poll()
+    assert poller.latest("AAPL") is None
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from api_classes import InvalidRequest
+from screener import RatioScreener
+
+
+class FakeRatiosApi:
+    def __init__(self):
+        self.ratios = {"AAA": {"peRatioTTM": 10.0, "returnOnEquityTTM": 0.2, "symbol": "AAA"},
+                       "BBB": {"peRatioTTM": 20.0, "returnOnEquityTTM": 0.05},
+                       "CCC": {"peRatioTTM": None, "returnOnEquityTTM": 0.3},
+                       "DDD": {"peRatioTTM": 10.0, "returnOnEquityTTM": -0.1}}
+        self.profiles = 0
+
+    def get_ratios(self, ticker_symbol):
+        return self.ratios[ticker_symbol]
+
+    def get_profile(self, ticker_symbol):
+        self.profiles += 1
+        return {"sector": "Tech" if ticker_symbol in ("AAA", "BBB") else "Energy"}
+
+
+@pytest.fixture
+def screener():
+    screener = RatioScreener(FakeRatiosApi())
+    screener.load(["AAA", "BBB", "CCC", "DDD"])
+    return screener
+
+
+def test_filter_expressions(screener):
+    assert screener.filter("peRatioTTM < 15") == ["AAA", "DDD"]
+    assert screener.filter("peRatioTTM < 15 & returnOnEquityTTM > 0") == ["AAA"]
+    assert screener.filter("peRatioTTM >= 20 | returnOnEquityTTM > 0.25") == ["BBB", "CCC"]
+    assert screener.filter("~(peRatioTTM < 15) & returnOnEquityTTM > -1") == ["BBB", "CCC"]
+    assert screener.filter("returnOnEquityTTM < peRatioTTM") == ["AAA", "BBB", "DDD"]
+    assert screener.filter("-0.5 < returnOnEquityTTM & returnOnEquityTTM < 1e-1") == ["BBB", "DDD"]
+    assert screener.filter(lambda columns: columns["peRatioTTM"] == 10) == ["AAA", "DDD"]
+
+
+@pytest.mark.parametrize("expression", ["__import__('os').system('true')", "peRatioTTM.__class__",
+                                        "peRatioTTM < 15 &", "(peRatioTTM < 15", "peRatioTTM",
+                                        "unknownTTM < 1", "1 < 2", "peRatioTTM + 1 < 2"])
+def test_invalid_expressions_are_rejected(screener, expression):
+    with pytest.raises(InvalidRequest):
+        screener.filter(expression)
+
+
+def test_percentile_ranks_average_ties(screener):
+    ranks = screener.percentile_ranks()
+    pe = screener.ratios.index("peRatioTTM")
+    np.testing.assert_array_equal(ranks[:, pe], [0.25, 1.0, np.nan, 0.25])
+
+
+def test_refresh_reuses_sectors(screener):
+    assert screener.fmp.profiles == 4
+    screener.max_age = 0
+    screener.refresh()
+    assert screener.fmp.profiles == 4
+    assert list(screener.sectors) == ["Tech", "Tech", "Energy", "Energy"]
@@ -0,0 +1,108 @@
+import time
+import threading
+import pytest
+from api_classes import InvalidResponse
+from snapshot import SnapshotPipeline
+
+
+class FakeApi:
+    # quotes and profiles for every symbol but "GONE", ratios of "SLOW" take a second
+    base_path = "https://financialmodelingprep.com/api"
+    api_key = "key"
+    key_pool = None
+
+    def __init__(self):
+        self.urls = []
+        self.conversions = []
+        self.lock = threading.Lock()
+
+    def make_request(self, url):
+        with self.lock:
+            self.urls.append(url)
+        symbols = [symbol.upper() for symbol in url.split("/")[-1].split("?")[0].split(",") if symbol.upper() != "GONE"]
+        if "/v3/quote-short/" in url:
+            return [{"symbol": symbol, "price": 10.0, "volume": 100} for symbol in symbols]
+        if "/v3/profile/" in url:
+            return [{"symbol": symbol, "currency": "EUR" if symbol.endswith(".DE") else "USD",
+                     "companyName": symbol.title(), "mktCap": 1000.0, "price": 10.0} for symbol in symbols]
+        raise InvalidResponse(f"Unexpected url <{url}>")
+
+    def get_ratios(self, ticker_symbol):
+        if ticker_symbol == "SLOW":
+            time.sleep(1)
+        return [{"peRatioTTM": 12.0}]
+
+    def convert_currency(self, convert_from, convert_to, value):
+        with self.lock:
+            self.conversions.append((convert_from, convert_to))
+        time.sleep(0.05)
+        return value * 0.5
+
+
+class FakeReverseEngineered:
+    def __init__(self):
+        self.flushed = 0
+
+    def fetch_price_target(self, ticker_symbol):
+        if ticker_symbol == "NOTARGET":
+            raise InvalidResponse("No price target in response")
+        return {"priceTarget": 15.0, "currency": "USD"}
+
+    def flush(self):
+        self.flushed += 1
+
+
+@pytest.fixture
+def pipeline():
+    return SnapshotPipeline(FakeApi(), FakeReverseEngineered())
+
+
+def test_batched_resources_are_matched_case_insensitively(pipeline):
+    response = pipeline.snapshot(["aapl", "MSFT"], ["price", "companyName"])
+    assert response == {"aapl": {"price": 10.0, "companyName": "Aapl"}, "MSFT": {"price": 10.0, "companyName": "Msft"}}
+    assert len(pipeline.fmp.urls) == 2
+
+
+def test_tickers_missing_in_a_batch_get_an_error(pipeline):
+    response = pipeline.snapshot(["AAPL", "GONE"], ["price", "marketCap"])
+    assert response["AAPL"] == {"price": 10.0, "marketCap": 1000.0}
+    assert response["GONE"]["price"] is None and response["GONE"]["marketCap"] is None
+    assert response["GONE"]["errors"] == {"price": "quote: missing in batched response",
+                                          "marketCap": "profile: missing in batched response"}
+
+
+def test_failed_dependencies_fail_the_dependent_fields_only(pipeline):
+    response = pipeline.snapshot(["AAPL", "NOTARGET"], ["price", "priceTarget", "upwardsPotential"])
+    assert response["AAPL"] == {"price": 10.0, "priceTarget": 15.0, "upwardsPotential": 0.5}
+    record = response["NOTARGET"]
+    assert record["price"] == 10.0 and record["priceTarget"] is None and record["upwardsPotential"] is None
+    assert record["errors"]["priceTarget"] == ("priceTarget: No price target in response; "
+                                               "priceTargetLocal: dependency failed")
+    assert pipeline.reverse_engineered.flushed == 1
+
+
+def test_exchange_rates_are_fetched_once_per_pair(pipeline):
+    ticker_symbols = [f"T{i}.DE" for i in range(10)] + ["AAPL"]
+    response = pipeline.snapshot(ticker_symbols, ["priceTarget"])
+    assert all(response[ticker_symbol]["priceTarget"] == 7.5 for ticker_symbol in ticker_symbols[:10])
+    assert response["AAPL"]["priceTarget"] == 15.0
+    assert pipeline.fmp.conversions == [("USD", "EUR")]
+    pipeline.snapshot(ticker_symbols, ["priceTarget"])
+    assert len(pipeline.fmp.conversions) == 1
+
+
+def test_deadline_returns_partial_records(pipeline):
+    started = time.monotonic()
+    response = pipeline.snapshot(["AAPL", "SLOW"], ["price", "ratios"], deadline=0.3)
+    assert time.monotonic() - started < 0.8
+    assert response["AAPL"] == {"price": 10.0, "ratios": [{"peRatioTTM": 12.0}]}
+    assert response["SLOW"]["price"] == 10.0 and response["SLOW"]["ratios"] is None
+    assert response["SLOW"]["errors"] == {"ratios": "timed out"}
+    assert response.timed_out == ["SLOW"]
+
+
+def test_count_requests(pipeline):
+    assert pipeline.plan(["upwardsPotential"]) == ["priceTarget", "profile", "priceTargetLocal", "quote"]
+    # 1200 tickers: 3 quote batches, 12 profile batches and 1200 price targets, the conversion
+    # to the listing currency only costs one request per currency pair
+    assert pipeline.count_requests(["upwardsPotential"], 1200) == 3 + 12 + 1200
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+from urllib.parse import urlparse, parse_qs
+from api_classes import FinancialModelingPrep, TreasuryCurve, InvalidResponse
+from auxiliary_functions import RateLimiter
+from key_pool import KeyPool
+
+
+class FakeTreasuryApi:
+    # one row per day of the requested window, windows starting in failing fail
+    def __init__(self):
+        self.windows = []
+        self.failing = set()
+
+    def make_request(self, url):
+        query = parse_qs(urlparse(url).query)
+        start, end = np.datetime64(query["from"][0]), np.datetime64(query["to"][0])
+        self.windows.append(str(start))
+        if str(start) in self.failing:
+            raise InvalidResponse("Limit Reach")
+        return [{"date": str(date), "year10": float(i)} for i, date in enumerate(np.arange(start, end + 1))]
+
+
+@pytest.fixture
+def api():
+    api = FakeTreasuryApi()
+    api.fmp = FinancialModelingPrep("key")
+    api.fmp.make_request = api.make_request
+    return api
+
+
+def test_cache_round_trip_without_npz_suffix(api, tmp_path):
+    path = str(tmp_path / "treasury")
+    curve = TreasuryCurve(api.fmp, cache_path=path, limiter=RateLimiter(0))
+    dates, tenors, rates = curve.get_rates("2020-01-01", "2020-06-30")
+    assert os.path.exists(path) and not os.path.exists(path + ".npz")
+    assert dates[0] == np.datetime64("2020-01-01") and dates[-1] == np.datetime64("2020-06-30")
+    assert rates.shape == (len(dates), len(tenors))
+
+    requests = len(api.windows)
+    restarted = TreasuryCurve(api.fmp, cache_path=path, limiter=RateLimiter(0))
+    assert restarted.chunks == curve.chunks
+    cached_dates, _, cached_rates = restarted.get_rates("2020-01-01", "2020-06-30")
+    assert len(api.windows) == requests
+    np.testing.assert_array_equal(cached_dates, dates)
+    np.testing.assert_array_equal(cached_rates, rates)
+
+
+def test_failed_chunks_stay_missing(api):
+    curve = TreasuryCurve(api.fmp, limiter=RateLimiter(0))
+    first = int(np.datetime64("2020-01-01", "D").astype(np.int64)) // curve.window_days
+    api.failing.add(str(np.datetime64(first * curve.window_days, "D")))
+    with pytest.raises(InvalidResponse):
+        curve.update("2020-01-01", "2020-06-30")
+    assert first not in curve.chunks and first + 1 in curve.chunks
+
+    api.failing.clear()
+    api.windows.clear()
+    assert curve.update("2020-01-01", "2020-06-30") == 1
+    assert api.windows == [str(np.datetime64(first * curve.window_days, "D"))]
+
+
+def test_limiter_defaults_to_the_key_pool_budget():
+    fmp = FinancialModelingPrep(KeyPool({"key1": 10, "key2": 30}))
+    assert TreasuryCurve(fmp).limiter.interval == pytest.approx(1 / 40)
+    limiter = RateLimiter(1)
+    assert TreasuryCurve(fmp, limiter=limiter).limiter is limiter
+    assert TreasuryCurve(FinancialModelingPrep("key")).limiter.interval == pytest.approx(1 / 5)
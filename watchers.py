@@ -0,0 +1,283 @@
+# polling components that keep state between calls and only hand changes to subscribers
+# Documentation is at: https://financialmodelingprep.com/developer/docs/
+
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from api_classes import InvalidRequest, EmptyResponse
+from auxiliary_functions import RateLimiter
+
+
+class MarketMoversWatcher:
+    # polls /v3/gainers and /v3/losers concurrently every interval seconds and emits the
+    # difference to the previous snapshot to all subscribers as a list of events:
+    #   ("enter", ticker_symbol, None, change)  ticker appeared in the gainers / losers lists
+    #   ("exit", ticker_symbol, change, None)   ticker dropped out of the lists
+    #   ("change", ticker_symbol, old, new)     abs(new - old) >= threshold
+    # changes are fractions like in get_gainers_losers (0.05 == 5%)
+    # limiter is the RateLimiter shared with the other consumers of the api key, every poll
+    # reserves two slots at once so the poll frequency can never exceed half of the shared
+    # budget while both requests are still sent together.
+    # a poll with a failing request raises and keeps the previous snapshot
+    def __init__(self, fmp, interval=5, threshold=0.01, minimum_change=0.0, mode="both", limiter=None):
+        self.fmp = fmp
+        self.interval = interval
+        self.threshold = threshold
+        self.minimum_change = minimum_change
+        self.mode = mode
+        self.limiter = limiter if limiter is not None else RateLimiter(interval / 2)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.subscribers = []
+        self.snapshot = {}
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def subscribe(self, callback):
+        # callback(events) is called from the polling thread whenever a poll produced events
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def fetch(self, endpoint):
+        url = self.fmp.base_path + f"/v3/{endpoint}?apikey={self.fmp.api_key}"
+        try:
+            return self.fmp.make_request(url)
+        except EmptyResponse:
+            return []  # empty list outside of trading hours
+
+    def parse(self, responses):
+        movers = {}
+        for response in responses:
+            for raw_dict in response:
+                raw_change = raw_dict["changesPercentage"]
+                if isinstance(raw_change, str):
+                    raw_change = raw_change.strip("()%+ ").replace("%", "")
+                change = float(raw_change) / 100
+                if abs(change) < self.minimum_change:
+                    continue
+                if self.mode == "gainers" and change < 0:
+                    continue
+                if self.mode == "loosers" and change > 0:
+                    continue
+                movers[raw_dict["ticker"]] = change
+        return movers
+
+    def diff(self, previous, current):
+        events = []
+        for ticker_symbol, change in current.items():
+            old = previous.get(ticker_symbol)
+            if old is None:
+                events.append(("enter", ticker_symbol, None, change))
+            elif abs(change - old) >= self.threshold:
+                events.append(("change", ticker_symbol, old, change))
+        for ticker_symbol, old in previous.items():
+            if ticker_symbol not in current:
+                events.append(("exit", ticker_symbol, old, None))
+        return events
+
+    def poll(self):
+        # runs one poll and returns the emitted events
+        self.limiter.acquire(2)
+        gainers = self.executor.submit(self.fetch, "gainers")
+        losers = self.executor.submit(self.fetch, "losers")
+        current = self.parse([gainers.result(), losers.result()])
+
+        events = self.diff(self.snapshot, current)
+        # tickers whose change stayed below the threshold keep their old value as reference
+        # so slow drifts are still reported once they add up to the threshold
+        for event, ticker_symbol, old, new in events:
+            if event == "exit":
+                del self.snapshot[ticker_symbol]
+            else:
+                self.snapshot[ticker_symbol] = new
+        if events:
+            for callback in list(self.subscribers):
+                try:
+                    callback(events)
+                except Exception as e:
+                    print(f"Error occured in subscriber <{callback}>: {e}")
+        return events
+
+    def run(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print("Error occured during poll:", e)
+            self.stop_event.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class QuotePoller:
+    # polls /v3/quote-short for all subscribed tickers in batches of batch_size symbols every
+    # interval seconds and stores every tick in preallocated ring buffers of capacity ticks per
+    # ticker, so memory stays flat no matter how long it runs (n_tickers * capacity * 24 bytes).
+    # there is one writer (the polling thread) and any number of readers. Instead of a lock the
+    # writer bumps self.sequence before and after every write (odd while writing), readers copy
+    # what they need and retry if the sequence changed in between.
+    # ticker symbols are upper case, subscribe and the readers accept any case
+    def __init__(self, fmp, interval=1, capacity=1024, batch_size=500, max_workers=4, limiter=None):
+        self.fmp = fmp
+        self.interval = interval
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.limiter = limiter if limiter is not None else RateLimiter(0)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.ticker_symbols = []
+        self.index = {}  # ticker_symbol -> row in the buffers
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.timestamps = np.zeros((0, capacity))
+        self.prices = np.zeros((0, capacity))
+        self.volumes = np.zeros((0, capacity))
+        self.counts = np.zeros(0, dtype=np.int64)  # total ticks written per ticker
+        self.sequence = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def subscribe(self, ticker_symbols):
+        # new tickers are picked up by the polling thread at the start of the next poll
+        with self.pending_lock:
+            self.pending.extend(ticker_symbol.strip().upper() for ticker_symbol in ticker_symbols)
+
+    def apply_pending(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        new = []
+        for ticker_symbol in pending:
+            if ticker_symbol not in self.index and ticker_symbol not in new:
+                new.append(ticker_symbol)
+        if not new:
+            return
+        rows = len(self.ticker_symbols)
+        timestamps = np.zeros((rows + len(new), self.capacity))
+        prices = np.zeros((rows + len(new), self.capacity))
+        volumes = np.zeros((rows + len(new), self.capacity))
+        counts = np.zeros(rows + len(new), dtype=np.int64)
+        timestamps[:rows], prices[:rows], volumes[:rows], counts[:rows] = self.timestamps, self.prices, self.volumes, self.counts
+
+        self.sequence += 1
+        self.timestamps, self.prices, self.volumes, self.counts = timestamps, prices, volumes, counts
+        for i, ticker_symbol in enumerate(new):
+            self.index[ticker_symbol] = rows + i
+        self.ticker_symbols = self.ticker_symbols + new
+        self.sequence += 1
+
+    def fetch(self, batch):
+        self.limiter.acquire()
+        url = self.fmp.base_path + f"/v3/quote-short/{','.join(batch)}?apikey={self.fmp.api_key}"
+        try:
+            return self.fmp.make_request(url)
+        except EmptyResponse:
+            return []  # none of the symbols is quoted, other errors are raised
+
+    def write(self, response, timestamp):
+        rows, prices, volumes = [], [], []
+        for raw_dict in response:
+            row = self.index.get(raw_dict["symbol"].upper())
+            if row is None or raw_dict["price"] is None:
+                continue
+            rows.append(row)
+            prices.append(raw_dict["price"])
+            volumes.append(raw_dict.get("volume") or 0)
+        if not rows:
+            return
+        rows = np.array(rows)
+        positions = self.counts[rows] % self.capacity
+
+        self.sequence += 1
+        self.timestamps[rows, positions] = timestamp
+        self.prices[rows, positions] = prices
+        self.volumes[rows, positions] = volumes
+        self.counts[rows] += 1
+        self.sequence += 1
+
+    def poll(self):
+        self.apply_pending()
+        symbols = self.ticker_symbols
+        batches = [symbols[i:i + self.batch_size] for i in range(0, len(symbols), self.batch_size)]
+        timestamp = time.time()
+        error = None
+        for task in [self.executor.submit(self.fetch, batch) for batch in batches]:
+            try:
+                self.write(task.result(), timestamp)
+            except Exception as e:
+                error = e  # the ticks of the other batches are still written
+        if error is not None:
+            raise error
+
+    def row(self, ticker_symbol):
+        row = self.index.get(ticker_symbol.strip().upper())
+        if row is None:
+            raise InvalidRequest(f"Ticker symbol <{ticker_symbol}> is not subscribed (yet)")
+        return row
+
+    def read(self, function):
+        # runs function without locking and retries until no write happened in the meantime
+        while True:
+            sequence = self.sequence
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            result = function()
+            if self.sequence == sequence:
+                return result
+
+    def latest(self, ticker_symbol):
+        # returns (timestamp, price, volume) of the last tick or None if there is none yet
+        def function():
+            row = self.row(ticker_symbol)
+            count = self.counts[row]
+            if not count:
+                return None
+            position = (count - 1) % self.capacity
+            return self.timestamps[row, position], self.prices[row, position], self.volumes[row, position]
+        return self.read(function)
+
+    def window(self, ticker_symbol, n_ticks=None):
+        # returns (timestamps, prices, volumes) of the last n_ticks ticks, oldest first, as copies
+        def function():
+            row = self.row(ticker_symbol)
+            count = int(self.counts[row])
+            n = min(count, self.capacity if n_ticks is None else n_ticks, self.capacity)
+            positions = np.arange(count - n, count) % self.capacity
+            return self.timestamps[row, positions], self.prices[row, positions], self.volumes[row, positions]
+        return self.read(function)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print("Error occured during poll:", e)
+            self.stop_event.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None